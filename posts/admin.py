@@ -1,31 +1,85 @@
 from django.contrib import admin
+from django.utils.html import format_html
 
-from .models import Comment, Follow, Group, Post
+from .models import Comment, Follow, Group, Job, Post, ProfileReport
+from .pagination import WindowedPaginator
+from .search import filter_groups, filter_posts
 
 
-class PostAdmin(admin.ModelAdmin):
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Список без точного COUNT(*) по всей таблице на каждой странице.
+    """
+    paginator = WindowedPaginator
+    show_full_result_count = False
+
+
+class PostAdmin(LargeTableAdmin):
     list_display = ("pk", "text", "pub_date", "author")
     search_fields = ("text",)
     list_filter = ("pub_date",)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Ищем по полнотекстовому индексу вместо ILIKE по всей таблице
+        if not search_term:
+            return queryset, False
+        queryset, _ = filter_posts(queryset, search_term)
+        return queryset, False
 
-class GroupAdmin(admin.ModelAdmin):
+
+class GroupAdmin(LargeTableAdmin):
     list_display = ("title", "slug", "description", "author")
+    search_fields = ("title",)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return filter_groups(queryset, search_term), False
+
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     list_display = ("text", 'author', 'post')
     empty_value_display = '-пусто-'
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdmin):
     list_display = ('pk', "user", 'following')
     empty_value_display = '-пусто-'
 
 
+class JobAdmin(LargeTableAdmin):
+    list_display = ('pk', 'name', 'status', 'attempts', 'run_at')
+    list_filter = ('status', 'name')
+    empty_value_display = '-пусто-'
+
+
+class ProfileReportAdmin(LargeTableAdmin):
+    list_display = ('created', 'method', 'path', 'user',
+                    'duration', 'sql_count', 'sql_time')
+    list_filter = ('url_name',)
+    readonly_fields = ('created', 'user', 'method', 'path', 'url_name',
+                       'duration', 'sql_count', 'sql_time',
+                       'breakdown_display', 'call_tree_display')
+    exclude = ('breakdown', 'call_tree')
+    empty_value_display = '-пусто-'
+
+    def has_add_permission(self, request):
+        return False
+
+    def breakdown_display(self, obj):
+        return format_html('<pre>{}</pre>', obj.breakdown)
+    breakdown_display.short_description = 'Разбивка времени'
+
+    def call_tree_display(self, obj):
+        return format_html('<pre>{}</pre>', obj.call_tree)
+    call_tree_display.short_description = 'Дерево вызовов'
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.register(Job, JobAdmin)
+admin.site.register(ProfileReport, ProfileReportAdmin)
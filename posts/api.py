@@ -0,0 +1,91 @@
+from functools import wraps
+
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+
+from .conditional import (conditional_page, feed_versions, follow_versions,
+                          profile_versions)
+from .models import Group, Post, User
+from .pagination import get_cursor_page
+from .serializers import comment_data, page_data, post_data
+from .views import feed_posts, get_comments_page, get_follow_page
+
+
+def api_response(data, status=200):
+    return JsonResponse(
+        data, status=status, json_dumps_params={'separators': (',', ':'),
+                                                'ensure_ascii': False})
+
+
+def api_view(view):
+    """
+    Разрешает только GET и отвечает на ошибки JSON, а не HTML-страницей.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            response = api_response(
+                {'detail': 'Метод не разрешен'}, status=405)
+            response['Allow'] = 'GET, HEAD'
+            return response
+        try:
+            return view(request, *args, **kwargs)
+        except Http404:
+            return api_response({'detail': 'Не найдено'}, status=404)
+    return wrapper
+
+
+def api_login_required(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return api_response(
+                {'detail': 'Требуется авторизация'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+@api_view
+@conditional_page(feed_versions)
+def posts(request):
+    page = get_cursor_page(request, feed_posts(), 10)
+    return api_response(page_data(page, post_data))
+
+
+@api_view
+@conditional_page(feed_versions)
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    page = get_cursor_page(request, feed_posts().filter(group=group), 10)
+    return api_response(page_data(page, post_data))
+
+
+@api_view
+@conditional_page(profile_versions)
+def profile_posts(request, username):
+    profile = get_object_or_404(User, username=username)
+    page = get_cursor_page(request, feed_posts().filter(author=profile.id), 5)
+    return api_response(page_data(page, post_data))
+
+
+@api_view
+@api_login_required
+@conditional_page(follow_versions)
+def follow_posts(request):
+    return api_response(page_data(get_follow_page(request), post_data))
+
+
+@api_view
+@conditional_page(feed_versions)
+def post_detail(request, post_id):
+    post = get_object_or_404(feed_posts(), id=post_id)
+    return api_response(post_data(post))
+
+
+@api_view
+@conditional_page(feed_versions)
+def post_comments(request, post_id):
+    if not Post.objects.filter(id=post_id).exists():
+        raise Http404
+    page = get_comments_page(request, post_id)
+    return api_response(page_data(page, comment_data))
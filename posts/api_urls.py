@@ -0,0 +1,21 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+    # Общая лента
+    path('posts/', api.posts, name='api_posts'),
+    # Запись
+    path('posts/<int:post_id>/', api.post_detail, name='api_post'),
+    # Комментарии к записи
+    path('posts/<int:post_id>/comments/', api.post_comments,
+         name='api_post_comments'),
+    # Лента группы
+    path('groups/<slug:slug>/posts/', api.group_posts,
+         name='api_group_posts'),
+    # Записи автора
+    path('users/<username>/posts/', api.profile_posts,
+         name='api_profile_posts'),
+    # Лента избранных авторов
+    path('follow/', api.follow_posts, name='api_follow'),
+]
@@ -0,0 +1,145 @@
+import json
+import math
+import time
+import urllib.error
+import urllib.request
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+
+from .models import Comment, Group, Post, User
+from .urls import urlpatterns
+
+
+# Маршруты, которые меняют данные даже на GET-запрос
+MUTATING = {'post_delete', 'delete_group', 'profile_follow', 'profile_unfollow'}
+
+
+def percentile(values, percent):
+    """
+    Перцентиль методом ближайшего ранга.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(timings, queries=None):
+    """
+    Сводка по времени ответов в миллисекундах. Без замеров (ноль
+    запросов или все упали) времена - None.
+    """
+    if not timings:
+        return {'requests': 0, 'p50': None, 'p95': None, 'p99': None,
+                'mean': None, 'rps': None}
+    total = sum(timings)
+    summary = {
+        'requests': len(timings),
+        'p50': percentile(timings, 50) * 1000,
+        'p95': percentile(timings, 95) * 1000,
+        'p99': percentile(timings, 99) * 1000,
+        'mean': total / len(timings) * 1000,
+        'rps': len(timings) / total if total else None,
+    }
+    if queries:
+        summary['queries'] = sum(queries) / len(queries)
+    return summary
+
+
+def sample_kwargs():
+    """
+    Значения параметров маршрутов из существующих данных.
+    """
+    post = Post.objects.select_related('author').order_by('-pub_date').first()
+    comment = Comment.objects.select_related('post__author').first()
+    group = Group.objects.order_by('pk').first()
+    if comment is not None:
+        post = comment.post
+    return {
+        'username': post.author.username if post else None,
+        'post_id': post.id if post else None,
+        'slug': group.slug if group else None,
+    }
+
+
+def routes():
+    """
+    Список (имя, путь) всех безопасных для GET маршрутов posts/urls.py.
+    """
+    kwargs = sample_kwargs()
+    result = []
+    for pattern in urlpatterns:
+        if not isinstance(pattern, URLPattern) or pattern.name in MUTATING:
+            continue
+        names = pattern.pattern.regex.groupindex
+        if any(kwargs.get(name) is None for name in names):
+            continue
+        result.append((pattern.name, reverse(
+            pattern.name, kwargs={name: kwargs[name] for name in names})))
+    return result
+
+
+def run_client(path, count, user=None):
+    """
+    Прогоняет запросы через тестовый клиент Django, без сети.
+    """
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    timings, queries = [], []
+    status = None
+    for _ in range(count):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            status = client.get(path).status_code
+            timings.append(time.perf_counter() - start)
+        queries.append(len(captured))
+    return timings, queries, status
+
+
+def run_http(base_url, path, count):
+    """
+    Прогоняет запросы к запущенному серверу, например gunicorn.
+    """
+    timings = []
+    status = None
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(base_url.rstrip('/') + path) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        timings.append(time.perf_counter() - start)
+    return timings, None, status
+
+
+def compare(current, baseline):
+    """
+    Разница в процентах между двумя прогонами по каждому маршруту.
+    """
+    result = {}
+    for name, summary in current['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        result[name] = {
+            metric: (summary[metric] - before[metric]) / before[metric] * 100
+            for metric in ('p50', 'p95', 'p99')
+            if before.get(metric) and summary[metric] is not None
+        }
+    return result
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def default_user():
+    return User.objects.filter(is_active=True).order_by('pk').first()
@@ -0,0 +1,99 @@
+import time
+
+from django.core.cache import cache
+
+from .routers import pin_if_recent
+
+
+# Общая версия лент: меняется при любом изменении записей, групп и комментариев
+FEED = 'feed'
+
+
+def _key(name):
+    return 'version:%s' % name
+
+
+def get_version(name):
+    """
+    Возвращает текущую версию ключей кэша с именем name.
+
+    Версия - это время последнего изменения, поэтому её же можно
+    использовать как дату изменения данных.
+    """
+    key = _key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time(), None)
+        version = cache.get(key, time.time())
+    pin_if_recent([version])
+    return version
+
+
+def get_versions(*names):
+    """
+    Текущие версии нескольких имен за одно обращение к кэшу.
+    """
+    found = cache.get_many([_key(name) for name in names])
+    versions = [
+        found.get(_key(name)) or get_version(name) for name in names
+    ]
+    pin_if_recent(versions)
+    return versions
+
+
+def user_version(user_id):
+    """
+    Имя версии данных пользователя: подписчики и подписки.
+    """
+    return 'user:%s' % user_id
+
+
+def timeline_version(user_id):
+    """
+    Имя версии ленты избранных авторов пользователя.
+    """
+    return 'timeline:%s' % user_id
+
+
+def post_tag(post_id):
+    return 'post:%s' % post_id
+
+
+def group_tag(group_id):
+    return 'group:%s' % group_id
+
+
+def feed_tag(*scope):
+    """
+    Тег состава ленты: feed_tag('index'), feed_tag('group', id),
+    feed_tag('author', id).
+    """
+    return 'feed:' + ':'.join(map(str, scope))
+
+
+def posts_tags(posts):
+    """
+    Теги записей на странице и групп, которые показаны в их карточках.
+    """
+    tags = []
+    for post in posts:
+        tags.append(post_tag(post.pk))
+        if post.group_id:
+            tags.append(group_tag(post.group_id))
+    return tags
+
+
+def tag_request(request, *tags):
+    """
+    Отмечает, от каких данных зависит страница, для кэша целых страниц.
+    """
+    if hasattr(request, 'cache_tags'):
+        request.cache_tags.update(tags)
+
+
+def bump_version(*names):
+    """
+    Делает устаревшими все ключи кэша, собранные на прежних версиях.
+    """
+    now = time.time()
+    cache.set_many({_key(name): now for name in names}, None)
@@ -0,0 +1,76 @@
+import datetime as dt
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .cache import FEED, get_versions, timeline_version, user_version
+from .models import User
+from .trending import TRENDING
+
+
+def feed_versions(request, **kwargs):
+    return [FEED]
+
+
+def profile_versions(request, username, **kwargs):
+    user_id = User.objects.filter(
+        username=username).values_list('id', flat=True).first()
+    return [FEED, user_version(user_id)]
+
+
+def trending_versions(request, **kwargs):
+    return [FEED, TRENDING]
+
+
+def follow_versions(request, **kwargs):
+    return [FEED, timeline_version(request.user.pk)]
+
+
+def _validators(request, versions_func, kwargs):
+    """
+    Версии данных страницы, посчитанные один раз на запрос.
+    """
+    if not hasattr(request, '_page_versions'):
+        request._page_versions = get_versions(*versions_func(request, **kwargs))
+    return request._page_versions
+
+
+def conditional_page(versions_func):
+    """
+    Отвечает 304 Not Modified до отрисовки страницы, если данные не менялись.
+
+    ETag строится из версий кэша (это время последнего изменения данных),
+    адреса с курсором и зрителя. Last-Modified отдается только анонимам:
+    у вошедших страница зависит от пользователя.
+    """
+    def etag(request, *args, **kwargs):
+        versions = _validators(request, versions_func, kwargs)
+        raw = '|'.join(map(str, versions + [
+            request.get_full_path(), request.user.pk]))
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return None
+        versions = _validators(request, versions_func, kwargs)
+        return dt.datetime.fromtimestamp(max(versions), dt.timezone.utc)
+
+    def decorator(view):
+        conditional_view = condition(
+            etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if request.user.is_authenticated:
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                patch_cache_control(
+                    response, public=True,
+                    max_age=getattr(settings, 'PAGE_CACHE_MAX_AGE', 0))
+            return response
+        return wrapper
+    return decorator
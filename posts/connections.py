@@ -0,0 +1,76 @@
+import logging
+import time
+from collections import Counter
+from functools import wraps
+
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.dispatch import receiver
+
+
+logger = logging.getLogger(__name__)
+
+# Что стало с открытыми соединениями в начале запросов этого воркера
+STATS = Counter()
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    """
+    Перед запросом разбирается с соединениями, оставшимися от прошлых.
+
+    Слишком долго простоявшее соединение закрывается, чтобы воркеры
+    не держали лишние соединения с базой. Остальные, если включен
+    CONN_HEALTH_CHECKS, проверяются пустым запросом при первом
+    обращении к базе в этом запросе (как в Django 4.1): страницам
+    из кэша и неиспользуемым репликам проверка ничего не стоит.
+    Возраст соединения ограничивает сам Django по CONN_MAX_AGE.
+    """
+    now = time.monotonic()
+    for conn in connections.all():
+        if conn.connection is None or conn.in_atomic_block:
+            continue
+        idle = now - getattr(conn, 'released_at', now)
+        idle_timeout = conn.settings_dict.get('CONN_IDLE_TIMEOUT')
+        if idle_timeout and idle > idle_timeout:
+            STATS['idle_closed'] += 1
+            conn.close()
+        elif conn.settings_dict.get('CONN_HEALTH_CHECKS'):
+            if not getattr(conn, 'health_check_installed', False):
+                conn.ensure_connection = _checked(conn, conn.ensure_connection)
+                conn.health_check_installed = True
+            conn.health_check_needed = True
+        else:
+            STATS['reused'] += 1
+
+
+def _checked(conn, ensure_connection):
+    """
+    ensure_connection, который перед первым использованием соединения
+    в запросе проверяет, не оборвала ли его база.
+    """
+    @wraps(ensure_connection)
+    def wrapper():
+        if getattr(conn, 'health_check_needed', False):
+            conn.health_check_needed = False
+            if conn.connection is not None and not conn.in_atomic_block:
+                if conn.is_usable():
+                    STATS['reused'] += 1
+                else:
+                    STATS['broken_closed'] += 1
+                    logger.warning('Соединение %s оборвано, открываем новое',
+                                   conn.alias)
+                    conn.close()
+        ensure_connection()
+    return wrapper
+
+
+@receiver(request_finished)
+def remember_release(sender, **kwargs):
+    """
+    Запоминает, когда соединения освободились, для подсчета простоя.
+    """
+    now = time.monotonic()
+    for conn in connections.all():
+        if conn.connection is not None:
+            conn.released_at = now
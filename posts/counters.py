@@ -0,0 +1,116 @@
+from django.db.models import (Count, DateTimeField, F, OuterRef, Subquery,
+                              Value)
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import (NO_ACTIVITY, Comment, Follow, Group, Post, User,
+                     UserStats)
+from .utils import chunks
+
+
+def _count(queryset, field):
+    """
+    Подзапрос с количеством строк queryset, связанных по полю field.
+    """
+    return Coalesce(Subquery(
+        queryset.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(c=Count('pk')).values('c')
+    ), Value(0))
+
+
+def reconcile_user(user_id):
+    """
+    Пересчитывает счетчики одного пользователя с нуля.
+    """
+    stats, _ = UserStats.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            'posts_count': Post.objects.filter(author=user_id).count(),
+            'followers_count': Follow.objects.filter(following=user_id).count(),
+            'following_count': Follow.objects.filter(user=user_id).count(),
+        }
+    )
+    return stats
+
+
+def get_stats(user):
+    """
+    Счетчики пользователя. Недостающая строка создается пересчетом.
+    """
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        return reconcile_user(user.id)
+
+
+def change_stats(user_id, **deltas):
+    """
+    Атомарно меняет счетчики пользователя на заданные величины.
+    """
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+    # При уменьшении строку не создаем: пользователь может удаляться
+    if not updated and all(delta > 0 for delta in deltas.values()):
+        reconcile_user(user_id)
+
+
+def change_comment_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comment_count=F('comment_count') + delta, version=F('version') + 1)
+
+
+def _last_post_date(field='pk'):
+    """
+    Подзапрос с датой последней записи группы.
+    """
+    return Subquery(
+        Post.objects.filter(group=OuterRef(field)).order_by(
+            '-pub_date').values('pub_date')[:1]
+    )
+
+
+def group_post_added(group_id, pub_date):
+    Group.objects.filter(pk=group_id).update(
+        posts_count=F('posts_count') + 1,
+        last_activity=Greatest(
+            F('last_activity'), Value(pub_date, DateTimeField())))
+
+
+def group_post_removed(group_id):
+    # Дата последней записи могла уйти вместе с записью
+    Group.objects.filter(pk=group_id).update(
+        posts_count=F('posts_count') - 1,
+        last_activity=Coalesce(_last_post_date(), Value(NO_ACTIVITY, DateTimeField())))
+
+
+def _only(queryset, ids, field='pk'):
+    if ids is None:
+        return queryset
+    return queryset.filter(**{field + '__in': ids})
+
+
+def reconcile_all(user_ids=None, post_ids=None, group_ids=None):
+    """
+    Исправляет расхождения счетчиков с реальными данными. Если переданы
+    наборы id, пересчитываются только эти пользователи, записи и группы.
+    """
+    for ids in chunks(user_ids):
+        UserStats.objects.bulk_create(
+            [UserStats(user_id=pk) for pk in _only(User.objects.filter(
+                stats__isnull=True), ids).values_list('pk', flat=True)],
+            ignore_conflicts=True,
+        )
+        _only(UserStats.objects, ids, 'user').update(
+            posts_count=_count(Post.objects, 'author'),
+            followers_count=_count(Follow.objects, 'following'),
+            following_count=_count(Follow.objects, 'user'),
+        )
+    for ids in chunks(post_ids):
+        _only(Post.objects, ids).update(
+            comment_count=_count(Comment.objects, 'post'))
+    for ids in chunks(group_ids):
+        _only(Group.objects, ids).update(
+            posts_count=_count(Post.objects, 'group'),
+            last_activity=Coalesce(_last_post_date(), Value(NO_ACTIVITY, DateTimeField())),
+        )
@@ -0,0 +1,103 @@
+import csv
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Comment
+
+
+# Сколько строк забирать из базы за раз: память не растет с размером выгрузки
+CHUNK_SIZE = 2000
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+}
+CSV_FIELDS = ('type', 'id', 'post_id', 'author', 'group', 'created', 'text',
+              'image', 'comment_count')
+
+
+def rows(posts, comments=True):
+    """
+    Строки выгрузки: сначала записи, затем комментарии к ним.
+    Курсор базы читается порциями, queryset не кэширует результат.
+    """
+    posts = posts.select_related('author', 'group').order_by('pub_date', 'id')
+    for post in posts.iterator(chunk_size=CHUNK_SIZE):
+        yield {
+            'type': 'post',
+            'id': post.id,
+            'post_id': post.id,
+            'author': post.author.username,
+            'group': post.group.slug if post.group_id else None,
+            'created': post.pub_date,
+            'text': post.text,
+            'image': post.image.name or None,
+            'comment_count': post.comment_count,
+        }
+    if not comments:
+        return
+    comments = Comment.objects.select_related('author').filter(
+        post__in=posts.values('id')).order_by('post_id', 'created', 'id')
+    for comment in comments.iterator(chunk_size=CHUNK_SIZE):
+        yield {
+            'type': 'comment',
+            'id': comment.id,
+            'post_id': comment.post_id,
+            'author': comment.author.username,
+            'created': comment.created,
+            'text': comment.text,
+        }
+
+
+def ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+class _Line:
+    """
+    Файл для csv.writer, который просто возвращает записанную строку.
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(_Line(), CSV_FIELDS, extrasaction='ignore')
+    yield writer.writeheader()
+    for row in rows:
+        row = dict(row)
+        row['created'] = row['created'].isoformat()
+        yield writer.writerow(row)
+
+
+def encode(lines, compress=False):
+    """
+    Кодирует строки в байты и, если нужно, сжимает gzip на лету.
+    Сжатые данные отдаются, как только zlib их выдаст.
+    """
+    if not compress:
+        for line in lines:
+            yield line.encode()
+        return
+    compressor = zlib.compressobj(wbits=31)
+    for line in lines:
+        chunk = compressor.compress(line.encode())
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def stream(posts, fmt='ndjson', compress=False, comments=True):
+    """
+    Поток байтов выгрузки записей posts в формате fmt.
+    """
+    lines = ndjson if fmt == 'ndjson' else csv_lines
+    return encode(lines(rows(posts, comments)), compress)
+
+
+def filename(name, fmt, compress=False):
+    return '%s.%s%s' % (name, FORMATS[fmt][1], '.gz' if compress else '')
+
@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from . import images
 from .models import Post, Group, Comment
 
 
@@ -8,6 +10,22 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ['text', 'image', 'group']
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            # Телефонные фото в десятки мегабайт не храним как есть
+            image = images.normalize(image)
+        return image
+
+    def save(self, commit=True):
+        post = super().save(commit=False)
+        if 'image' in self.changed_data:
+            # Миниатюры для новой картинки нарежет фоновый обработчик
+            post.thumbnails_ready = False
+        if commit:
+            post.save()
+        return post
+
 
 class GroupForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,38 @@
+import io
+import os
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps
+
+
+# Большая сторона оригинала после загрузки, в пикселях
+MAX_SIDE = 2048
+JPEG_QUALITY = 85
+
+
+def normalize(upload):
+    """
+    Приводит загруженную картинку к разумному размеру: поворачивает
+    по EXIF, уменьшает до MAX_SIDE и пересохраняет без метаданных.
+    Анимации оставляются как есть.
+    """
+    upload.seek(0)
+    image = Image.open(upload)
+    if getattr(image, 'is_animated', False):
+        upload.seek(0)
+        return upload
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+    has_alpha = image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info)
+    buffer = io.BytesIO()
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    if has_alpha:
+        image.save(buffer, 'PNG', optimize=True)
+        name, content_type = stem + '.png', 'image/png'
+    else:
+        image.convert('RGB').save(
+            buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True,
+            progressive=True)
+        name, content_type = stem + '.jpg', 'image/jpeg'
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type)
@@ -0,0 +1,346 @@
+import csv
+import gzip
+import io
+import json
+from collections import Counter, defaultdict
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import counters, search, storage, timeline
+from .cache import FEED, bump_version
+from .models import Comment, Follow, Group, ImportedObject, Post, User
+from .utils import chunks, manual_dates, unique_slugs
+
+
+BATCH_SIZE = 5000
+
+# Внутри пачки строки загружаются в таком порядке, чтобы комментарии
+# находили записи, а записи - группы из той же пачки
+KINDS = ('group', 'post', 'comment', 'follow')
+
+
+def read_rows(path, fmt=None):
+    """
+    Строки файла NDJSON или CSV (в том числе сжатого gzip) как словари.
+    Формат определяется по расширению, если не задан.
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    if fmt is None:
+        fmt = 'csv' if name.endswith('.csv') else 'ndjson'
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def batches(rows, size, skip=0):
+    """
+    Делит строки на пачки, пропуская первые skip уже загруженных.
+    """
+    batch = []
+    for number, row in enumerate(rows):
+        if number < skip:
+            continue
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_date(value):
+    if not value:
+        return timezone.now()
+    date = parse_datetime(value)
+    if date is None:
+        return timezone.now()
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+def _copy_value(value):
+    # В CSV для COPY пустое поле без кавычек - это NULL, а "" -
+    # пустая строка, поэтому все значения, кроме None, берутся в кавычки
+    if value is None:
+        return ''
+    return '"%s"' % str(value).replace('"', '""')
+
+
+def copy_rows(fields, objects):
+    """
+    Строки объектов в формате CSV для COPY ... FROM STDIN.
+    """
+    return ''.join(
+        ','.join(
+            _copy_value(field.get_db_prep_save(
+                getattr(obj, field.attname), connection))
+            for field in fields
+        ) + '\n'
+        for obj in objects
+    )
+
+
+class Importer:
+    """
+    Загружает пачки строк импорта: одна пачка - одна транзакция.
+
+    Созданные объекты запоминаются в ImportedObject, поэтому повтор
+    пачки после сбоя не создает дублей. Сигналы моделей не отправляются,
+    производные данные пересчитываются в finish().
+    """
+
+    def __init__(self, source, use_copy=None):
+        self.source = source
+        if use_copy is None:
+            use_copy = connection.vendor == 'postgresql'
+        self.use_copy = use_copy
+        self.counts = Counter()
+        # Что затронул импорт: производные данные пересчитываются только
+        # для этих строк
+        self.touched = defaultdict(set)
+
+    def load(self, rows):
+        by_kind = defaultdict(list)
+        for row in rows:
+            by_kind[row.get('type')].append(row)
+        for kind in set(by_kind) - set(KINDS):
+            self.counts['skipped'] += len(by_kind[kind])
+        with transaction.atomic():
+            self.load_groups(by_kind['group'])
+            self.load_posts(by_kind['post'])
+            self.load_comments(by_kind['comment'])
+            self.load_follows(by_kind['follow'])
+
+    def finish(self):
+        """
+        Пересчитывает производные данные только для того, что загрузил
+        импорт: счетчики пользователей, записей и групп, ленты (новые
+        записи раскладываются подписчикам, новым подпискам добавляются
+        записи автора), поисковые векторы и ссылки на файлы картинок.
+        """
+        touched = self.touched
+        counters.reconcile_all(
+            user_ids=touched['user'], post_ids=touched['post'],
+            group_ids=touched['group'])
+        timeline.fan_out_posts(touched['new_post'])
+        for user_id, author_id in sorted(touched['follow']):
+            timeline.backfill(user_id, author_id)
+        images = set()
+        for ids in chunks(touched['new_post']):
+            images.update(Post.objects.filter(pk__in=ids).exclude(
+                image='').values_list('image', flat=True))
+        storage.reconcile(names=images)
+        search.update_all_vectors(
+            post_ids=touched['new_post'], group_ids=touched['group'])
+        bump_version(FEED)
+
+    def load_groups(self, rows):
+        rows = self.new_rows('group', rows, key=self.group_key)
+        titled = [row for row in rows if row.get('title')]
+        self.counts['skipped'] += len(rows) - len(titled)
+        rows = titled
+        if not rows:
+            return
+        users = self.users(row.get('author') for row in rows)
+        ids = self.reserve_ids(Group, len(rows))
+        slugs = unique_slugs(row.get('slug') or row['title'] for row in rows)
+        groups = [
+            Group(id=pk, title=row['title'], slug=slug,
+                  description=row.get('description') or '',
+                  author_id=users.get(row.get('author')))
+            for pk, slug, row in zip(ids, slugs, rows)
+        ]
+        self.insert(Group, groups)
+        self.remember('group', [self.group_key(row) for row in rows], ids)
+        self.touched['group'].update(ids)
+
+    def load_posts(self, rows):
+        rows = self.new_rows('post', rows)
+        if not rows:
+            return
+        users = self.users(row.get('author') for row in rows)
+        groups = self.groups(row.get('group') for row in rows)
+        authored = [row for row in rows if row.get('author') in users]
+        self.counts['skipped'] += len(rows) - len(authored)
+        rows = authored
+        ids = self.reserve_ids(Post, len(rows))
+        posts = [
+            Post(id=pk, text=row.get('text') or '',
+                 pub_date=parse_date(row.get('created')),
+                 author_id=users[row['author']],
+                 group_id=groups.get(str(row.get('group'))),
+                 image=row.get('image') or '')
+            for pk, row in zip(ids, rows)
+        ]
+        self.insert(Post, posts)
+        self.remember('post', [self.key(row) for row in rows], ids)
+        self.touched['post'].update(ids)
+        self.touched['new_post'].update(ids)
+        self.touched['user'].update(post.author_id for post in posts)
+        self.touched['group'].update(
+            post.group_id for post in posts if post.group_id)
+
+    def load_comments(self, rows):
+        rows = self.new_rows('comment', rows)
+        if not rows:
+            return
+        users = self.users(row.get('author') for row in rows)
+        posts = self.mapped('post', [str(row.get('post_id')) for row in rows])
+        # Комментарии к записям, которых еще нет (в том числе из следующих
+        # пачек), не загружаются
+        found = [row for row in rows if row.get('author') in users
+                 and str(row.get('post_id')) in posts]
+        self.counts['skipped'] += len(rows) - len(found)
+        rows = found
+        ids = self.reserve_ids(Comment, len(rows))
+        comments = [
+            Comment(id=pk, post_id=posts[str(row['post_id'])],
+                    author_id=users[row['author']], text=row.get('text') or '',
+                    created=parse_date(row.get('created')))
+            for pk, row in zip(ids, rows)
+        ]
+        self.insert(Comment, comments)
+        self.remember('comment', [self.key(row) for row in rows], ids)
+        self.touched['post'].update(comment.post_id for comment in comments)
+
+    def load_follows(self, rows):
+        users = self.users(
+            name for row in rows for name in (row.get('user'),
+                                              row.get('following')))
+        pairs = {
+            (users[row['user']], users[row['following']])
+            for row in rows
+            if row.get('user') in users and row.get('following') in users
+            and row['user'] != row['following']
+        }
+        existing = set(Follow.objects.filter(
+            user__in={user for user, _ in pairs},
+            following__in={following for _, following in pairs},
+        ).values_list('user_id', 'following_id')) if pairs else set()
+        new = pairs - existing
+        self.counts['skipped'] += len(rows) - len(new)
+        # Подписку, созданную параллельно, пропускает сама база
+        Follow.objects.bulk_create(
+            [Follow(user_id=user, following_id=following)
+             for user, following in new],
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
+        self.counts['follow'] += len(new)
+        for user, following in new:
+            self.touched['user'].update((user, following))
+        self.touched['follow'].update(new)
+
+    def key(self, row):
+        return str(row.get('id') or '')
+
+    def group_key(self, row):
+        return str(row.get('id') or row.get('slug') or row.get('title'))
+
+    def new_rows(self, kind, rows, key=None):
+        """
+        Отбрасывает строки, которые уже загружены прошлыми запусками.
+        """
+        key = key or self.key
+        done = self.mapped(kind, [key(row) for row in rows if key(row)])
+        new = [row for row in rows if not key(row) or key(row) not in done]
+        self.counts['skipped'] += len(rows) - len(new)
+        return new
+
+    def mapped(self, kind, source_ids):
+        if not source_ids:
+            return {}
+        return dict(ImportedObject.objects.filter(
+            source=self.source, kind=kind, source_id__in=set(source_ids)
+        ).values_list('source_id', 'object_id'))
+
+    def remember(self, kind, source_ids, ids):
+        ImportedObject.objects.bulk_create(
+            [ImportedObject(source=self.source, kind=kind,
+                            source_id=source_id, object_id=pk)
+             for source_id, pk in zip(source_ids, ids) if source_id],
+            batch_size=BATCH_SIZE)
+        self.counts[kind] += len(ids)
+
+    def users(self, usernames):
+        """
+        id пользователей по именам; недостающие создаются без пароля.
+        """
+        usernames = {name for name in usernames if name}
+        found = dict(User.objects.filter(
+            username__in=usernames).values_list('username', 'id'))
+        missing = usernames - set(found)
+        if missing:
+            # Непригодный пароль случаен, по нему видно, какие строки
+            # вставила эта пачка, а какие успел создать кто-то другой
+            password = make_password(None)
+            User.objects.bulk_create(
+                [User(username=name, password=password) for name in missing],
+                batch_size=BATCH_SIZE, ignore_conflicts=True)
+            created = dict(User.objects.filter(
+                username__in=missing).values_list('username', 'password'))
+            found.update(User.objects.filter(
+                username__in=missing).values_list('username', 'id'))
+            self.counts['user'] += sum(
+                1 for value in created.values() if value == password)
+        return found
+
+    def groups(self, keys):
+        """
+        id групп по ключу строки импорта или по slug существующей группы.
+        """
+        keys = {str(key) for key in keys if key}
+        found = self.mapped('group', keys)
+        found.update(Group.objects.filter(
+            slug__in=keys - set(found)).values_list('slug', 'id'))
+        return found
+
+    def reserve_ids(self, model, count):
+        """
+        Заранее выделяет id для пачки, чтобы связать строки без чтения
+        вставленных объектов обратно. В PostgreSQL id берутся из
+        последовательности, в остальных базах - после максимального
+        (там импорт должен идти в один поток).
+        """
+        if not count:
+            return []
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                    "FROM generate_series(1, %s)",
+                    [model._meta.db_table, count])
+                return [row[0] for row in cursor.fetchall()]
+        start = (model.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+        return list(range(start, start + count))
+
+    def insert(self, model, objects):
+        if self.use_copy:
+            self.copy(model, objects)
+            return
+        dates = [field for field in model._meta.concrete_fields
+                 if getattr(field, 'auto_now_add', False)]
+        with manual_dates(*dates):
+            model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+
+    def copy(self, model, objects):
+        """
+        Вставка через COPY FROM STDIN в формате CSV - в PostgreSQL это
+        заметно быстрее INSERT.
+        """
+        fields = model._meta.concrete_fields
+        buffer = io.StringIO(copy_rows(fields, objects))
+        columns = ', '.join(
+            connection.ops.quote_name(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (
+                connection.ops.quote_name(model._meta.db_table), columns),
+                buffer)
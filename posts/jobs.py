@@ -0,0 +1,109 @@
+import datetime as dt
+import json
+import random
+import traceback
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import routers
+from .models import Job
+
+
+# Зарегистрированные задачи: имя -> функция
+TASKS = {}
+
+# Сколько секунд задача принадлежит взявшему её обработчику
+LEASE = 300
+
+# Базовая задержка перед повтором, растет как BACKOFF * 2 ** попытка
+BACKOFF = 10
+
+
+def task(name):
+    """
+    Регистрирует функцию как фоновую задачу с именем name.
+    """
+    def decorator(func):
+        TASKS[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, run_at=None, max_attempts=5, **payload):
+    """
+    Ставит задачу в очередь. Аргументы задачи должны сериализоваться в JSON.
+    """
+    return Job.objects.create(
+        name=name,
+        payload=json.dumps(payload),
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts,
+    )
+
+
+def claim(batch_size):
+    """
+    Забирает пачку готовых к выполнению задач, чтобы их не взял
+    другой обработчик.
+
+    Попытка засчитывается при захвате: если обработчик упал вместе
+    с задачей, после истечения аренды она вернется уже с увеличенным
+    счетчиком, а исчерпавшая попытки помечается ошибочной.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True).filter(
+                Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+                status=Job.PENDING, run_at__lte=now,
+            ).order_by('run_at')[:batch_size]
+        )
+        exhausted = [job.pk for job in jobs
+                     if job.attempts >= job.max_attempts]
+        Job.objects.filter(pk__in=exhausted).update(
+            status=Job.FAILED, locked_until=None,
+            last_error='Обработчик не завершил задачу за время аренды')
+        jobs = [job for job in jobs if job.pk not in exhausted]
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            locked_until=now + dt.timedelta(seconds=LEASE),
+            attempts=F('attempts') + 1)
+    for job in jobs:
+        job.attempts += 1
+    return jobs
+
+
+def run(job):
+    """
+    Выполняет задачу. Успешная задача удаляется, упавшая откладывается
+    с экспоненциальной задержкой или помечается ошибочной.
+    """
+    try:
+        func = TASKS[job.name]
+        func(**json.loads(job.payload))
+    except Exception:
+        job.last_error = traceback.format_exc()
+        job.locked_until = None
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+        else:
+            delay = BACKOFF * 2 ** job.attempts * random.uniform(1, 1.5)
+            job.run_at = timezone.now() + dt.timedelta(seconds=delay)
+        job.save()
+        return False
+    job.delete()
+    return True
+
+
+def run_batch(batch_size=10):
+    """
+    Выполняет одну пачку задач, возвращает число выполненных.
+    """
+    jobs = claim(batch_size)
+    # Задачи разбирают только что записанные данные, которые реплики
+    # могли еще не получить
+    routers.pin_to_primary()
+    for job in jobs:
+        run(job)
+    return len(jobs)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from posts.cache import FEED, bump_version, group_tag
+from posts.models import Group, Post
+from posts.utils import slug_base, unique_slugs
+
+
+class Command(BaseCommand):
+    help = ('Проставляет slug пачками группам, у которых он пустой или не '
+            'соответствует названию, например после импорта')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересчитать slug всех групп по названиям')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        groups = Group.objects.order_by('pk')
+        last_pk = 0
+        done = 0
+        while True:
+            batch = list(groups.filter(pk__gt=last_pk).only(
+                'pk', 'title', 'slug')[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            if not options['all']:
+                batch = [group for group in batch if not group.slug
+                         or not group.slug.startswith(slug_base(group.title))]
+            slugs = unique_slugs(
+                [group.title for group in batch],
+                exclude=[group.pk for group in batch])
+            changed = []
+            for group, slug in zip(batch, slugs):
+                if group.slug != slug:
+                    group.slug = slug
+                    changed.append(group)
+            if not changed:
+                continue
+            with transaction.atomic():
+                Group.objects.bulk_update(changed, ['slug'])
+                # bulk_update не отправляет post_save: карточки записей
+                # и страницы групп ссылались бы на старые slug
+                Post.objects.filter(group__in=changed).update(
+                    version=F('version') + 1)
+            bump_version(*[group_tag(group.pk) for group in changed])
+            done += len(changed)
+        if done:
+            bump_version(FEED)
+        self.stdout.write('Обновлено slug: %d' % done)
@@ -0,0 +1,72 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from posts import benchmark
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Измеряет время ответа всех страниц posts/urls.py'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument(
+            '--url',
+            help='Адрес запущенного сервера; без него запросы идут '
+                 'через тестовый клиент Django')
+        parser.add_argument(
+            '--user', help='От чьего имени ходить (только для клиента)')
+        parser.add_argument('--route', action='append', dest='only')
+        parser.add_argument('--output', help='Куда сохранить результат в JSON')
+        parser.add_argument('--compare', help='JSON прошлого прогона')
+
+    def handle(self, *args, **options):
+        user = None
+        if not options['url']:
+            if options['user']:
+                user = User.objects.filter(username=options['user']).first()
+                if user is None:
+                    raise CommandError('Нет пользователя %s' % options['user'])
+            else:
+                user = benchmark.default_user()
+        result = {
+            'started': timezone.now().isoformat(),
+            'mode': 'http' if options['url'] else 'client',
+            'requests': options['requests'],
+            'routes': {},
+        }
+        for name, path in benchmark.routes():
+            if options['only'] and name not in options['only']:
+                continue
+            if options['url']:
+                benchmark.run_http(options['url'], path, options['warmup'])
+                timings, queries, status = benchmark.run_http(
+                    options['url'], path, options['requests'])
+            else:
+                benchmark.run_client(path, options['warmup'], user)
+                timings, queries, status = benchmark.run_client(
+                    path, options['requests'], user)
+            summary = benchmark.summarize(timings, queries)
+            summary.update(path=path, status=status)
+            result['routes'][name] = summary
+            if not summary['requests']:
+                self.stdout.write('%-15s %3s нет замеров' % (name, status))
+                continue
+            self.stdout.write(
+                '%-15s %3s p50 %7.1f мс  p95 %7.1f мс  p99 %7.1f мс  '
+                '%6.1f rps  %s запросов' % (
+                    name, status, summary['p50'], summary['p95'],
+                    summary['p99'], summary['rps'] or 0,
+                    '%.1f' % summary['queries'] if 'queries' in summary
+                    else '-'))
+        if options['compare']:
+            diff = benchmark.compare(result, benchmark.load(options['compare']))
+            for name, metrics in diff.items():
+                self.stdout.write('%-15s %s' % (name, '  '.join(
+                    '%s %+.1f%%' % item for item in metrics.items())))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время ответа с новым соединением с базой '
+            'на каждый запрос и с переиспользованным')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--route', default='index')
+
+    def handle(self, *args, **options):
+        path = dict(benchmark.routes()).get(options['route'])
+        if path is None:
+            raise CommandError('Нет маршрута %s' % options['route'])
+        count = options['requests']
+        connect = []
+        for _ in range(count):
+            connection.close()
+            start = time.perf_counter()
+            connection.ensure_connection()
+            connect.append(time.perf_counter() - start)
+        self.report('подключение', benchmark.summarize(connect))
+        # Так работает CONN_MAX_AGE=0: соединение закрывается
+        # в конце каждого запроса
+        fresh = self.run(path, count, reconnect=True)
+        self.report('новое', fresh)
+        reused = self.run(path, count, reconnect=False)
+        self.report('повторное', reused)
+        if not count:
+            return
+        self.stdout.write(
+            'Экономия на запрос: %.2f мс (p50), %.2f мс (среднее)' % (
+                fresh['p50'] - reused['p50'], fresh['mean'] - reused['mean']))
+
+    def run(self, path, count, reconnect):
+        # От имени пользователя, чтобы не попадать в кэш страниц
+        client = Client()
+        user = benchmark.default_user()
+        if user is not None:
+            client.force_login(user)
+        client.get(path)
+        timings = []
+        for _ in range(count):
+            if reconnect:
+                connection.close()
+            start = time.perf_counter()
+            client.get(path)
+            timings.append(time.perf_counter() - start)
+        return benchmark.summarize(timings)
+
+    def report(self, name, summary):
+        if not summary['requests']:
+            self.stdout.write('%-12s нет замеров' % name)
+            return
+        self.stdout.write(
+            '%-12s p50 %7.2f мс  p95 %7.2f мс  среднее %7.2f мс' % (
+                name, summary['p50'], summary['p95'], summary['mean']))
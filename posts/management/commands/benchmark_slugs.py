@@ -0,0 +1,43 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import slugify
+
+from posts.utils import alphabet, my_slugify
+
+
+TITLES = [
+    'Любители котов и кошек',
+    'Щёлковские рыбаки: ёрш, щука и прочие',
+    'Python и Django для начинающих',
+    'Клуб «Что? Где? Когда?» — обсуждения',
+    'Кулинария',
+]
+
+
+def legacy_slugify(s):
+    """
+    Прежняя реализация: поиск в словаре на каждый символ и slugify.
+    """
+    return slugify(''.join(alphabet.get(w, w) for w in s.lower()))
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость my_slugify с прежней реализацией'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        number = options['number']
+        results = {}
+        for name, func in (('прежняя', legacy_slugify),
+                           ('таблица', my_slugify)):
+            total = min(timeit.repeat(
+                lambda: [func(title) for title in TITLES],
+                number=number, repeat=3))
+            results[name] = total / (number * len(TITLES)) * 1e6
+            self.stdout.write('%-8s %.2f мкс на название' % (
+                name, results[name]))
+        self.stdout.write('Ускорение: %.1fx' % (
+            results['прежняя'] / results['таблица']))
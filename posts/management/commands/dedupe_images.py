@@ -0,0 +1,52 @@
+import re
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from sorl.thumbnail import delete as delete_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+from posts import storage
+from posts.cache import FEED, bump_version
+from posts.models import Post
+
+
+# Имя файла, которое уже дало хранилище по содержимому
+HASHED = re.compile(r'/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки, загруженные до хранилища по содержимому, '
+            'под имена-хэши и пересчитывает ссылки на файлы')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать файлы со старыми именами')
+
+    def handle(self, *args, **options):
+        names = set(Post.objects.exclude(image='').values_list(
+            'image', flat=True))
+        legacy = sorted(name for name in names if not HASHED.search(name))
+        if options['dry_run']:
+            self.stdout.write('Файлов со старыми именами: %d' % len(legacy))
+            return
+        moved = missing = 0
+        for name in legacy:
+            if not storage.post_images.exists(name):
+                missing += 1
+                continue
+            with storage.post_images.open(name) as f:
+                new_name = storage.post_images.save(name, f)
+            # Миниатюры старого имени удаляются, для нового их нарежет
+            # generate_thumbnails (или они уже есть у такой же картинки)
+            Post.objects.filter(image=name).update(
+                image=new_name, thumbnails_ready=False,
+                version=F('version') + 1)
+            delete_thumbnails(ImageFile(name, storage=storage.post_images))
+            moved += 1
+        files = storage.reconcile()
+        if moved:
+            bump_version(FEED)
+        self.stdout.write(self.style.SUCCESS(
+            'Перенесено файлов: %d, не найдено: %d, файлов со ссылками: %d'
+            % (moved, missing, files)))
@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+from posts.models import Group, Post, User
+
+
+class Command(BaseCommand):
+    help = 'Выгружает записи и комментарии автора или группы потоком'
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--user')
+        source.add_argument('--group', help='slug группы')
+        parser.add_argument(
+            '--format', choices=sorted(export.FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument(
+            '--no-comments', action='store_true',
+            help='Только записи, без комментариев')
+        parser.add_argument('--output', help='Файл; по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        if options['user']:
+            author = User.objects.filter(username=options['user']).first()
+            if author is None:
+                raise CommandError('Нет пользователя %s' % options['user'])
+            posts = Post.objects.filter(author=author)
+        else:
+            group = Group.objects.filter(slug=options['group']).first()
+            if group is None:
+                raise CommandError('Нет группы %s' % options['group'])
+            posts = Post.objects.filter(group=group)
+        chunks = export.stream(
+            posts, options['format'], options['gzip'],
+            comments=not options['no_comments'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            out = sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Нарезает миниатюры картинок записей, для которых это не сделала '
+            'очередь задач (например, после импорта)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Прогреть миниатюры всех записей с картинками')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        # Новые загрузки нарезает задача generate_thumbnails в run_jobs
+        queryset = (Post.objects.exclude(image='') if options['all']
+                    else thumbnails.pending())
+        done = thumbnails.process(queryset, options['batch_size'])
+        self.stdout.write('Обработано записей: %d' % done)
@@ -0,0 +1,72 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import importer
+
+
+class Command(BaseCommand):
+    help = ('Загружает группы, записи, комментарии и подписки из NDJSON '
+            'или CSV пачками, с продолжением с места остановки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('ndjson', 'csv'))
+        parser.add_argument(
+            '--source',
+            help='Имя источника для учета загруженных строк; '
+                 'по умолчанию имя файла')
+        parser.add_argument(
+            '--batch-size', type=int, default=importer.BATCH_SIZE)
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл с числом загруженных строк; по умолчанию '
+                 '<path>.checkpoint')
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать сначала, не глядя на checkpoint')
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Не использовать COPY даже в PostgreSQL')
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Не пересчитывать счетчики, ленты и поиск после загрузки')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError('Нет файла %s' % path)
+        checkpoint = options['checkpoint'] or path + '.checkpoint'
+        done = 0
+        if not options['restart'] and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                done = json.load(f)['rows']
+            self.stdout.write('Продолжаем после строки %d' % done)
+        loader = importer.Importer(
+            options['source'] or os.path.basename(path),
+            use_copy=False if options['no_copy'] else None)
+        rows = importer.read_rows(path, options['format'])
+        started = time.monotonic()
+        loaded = 0
+        for batch in importer.batches(rows, options['batch_size'], done):
+            loader.load(batch)
+            done += len(batch)
+            loaded += len(batch)
+            with open(checkpoint, 'w') as f:
+                json.dump({'rows': done}, f)
+            elapsed = time.monotonic() - started
+            self.stdout.write('Строк %d, %.0f строк/с' % (
+                done, loaded / elapsed if elapsed else 0))
+        if not options['skip_derived']:
+            self.stdout.write('Пересчет счетчиков, лент и поиска...')
+            loader.finish()
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            'Загружено строк %d за %.1f с (%.0f строк/с): %s' % (
+                loaded, elapsed, loaded / elapsed if elapsed else 0,
+                ', '.join('%s %d' % item
+                          for item in sorted(loader.counts.items())))))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.middleware import page_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша страниц для анонимов'
+
+    def handle(self, *args, **options):
+        for name, stats in page_cache_stats().items():
+            total = stats['hits'] + stats['misses']
+            ratio = stats['hits'] / total * 100 if total else 0
+            self.stdout.write('%-10s попаданий %8d  промахов %8d  %5.1f%%' % (
+                name, stats['hits'], stats['misses'], ratio))
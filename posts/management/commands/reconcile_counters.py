@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile_all
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики комментариев, подписок и записей'
+
+    def handle(self, *args, **options):
+        reconcile_all()
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import jobs
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить всё, что готово, и выйти')
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--sleep', type=float, default=1)
+
+    def handle(self, *args, **options):
+        while True:
+            done = jobs.run_batch(options['batch_size'])
+            if done:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
@@ -0,0 +1,160 @@
+import io
+import random
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from PIL import Image
+
+from posts import counters, search, storage, timeline
+from posts.cache import FEED, bump_version
+from posts.models import Comment, Follow, Group, Post, User
+from posts.utils import manual_dates, my_slugify
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими пользователями, группами и записями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--follows', type=int, default=20000)
+        parser.add_argument(
+            '--images', type=int, default=20,
+            help='Сколько разных картинок сгенерировать')
+        parser.add_argument(
+            '--image-ratio', type=float, default=0.2,
+            help='Доля записей с картинкой')
+        parser.add_argument(
+            '--skew', type=float, default=1.2,
+            help='Показатель закона Ципфа: чем больше, тем сильнее '
+                 'выделяются популярные авторы')
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.days = options['days']
+        self.run = uuid.uuid4().hex[:6]
+
+        users = self.create_users(options['users'])
+        # Веса по закону Ципфа: первые пользователи - "знаменитости"
+        weights = [1 / (rank ** options['skew'])
+                   for rank in range(1, len(users) + 1)]
+        groups = self.create_groups(options['groups'], users)
+        images = self.create_images(options['images'])
+        posts = self.create_posts(
+            options['posts'], users, weights, groups, images,
+            options['image_ratio'])
+        self.create_comments(options['comments'], users, posts, weights)
+        self.create_follows(options['follows'], users, weights)
+
+        # bulk_create не отправляет сигналы, пересчитываем производные данные
+        counters.reconcile_all()
+        storage.reconcile()
+        timeline.rebuild()
+        search.update_all_vectors()
+        bump_version(FEED)
+        self.stdout.write(self.style.SUCCESS(
+            'Создано: пользователей %d, групп %d, записей %d' % (
+                len(users), len(groups), len(posts))))
+
+    def random_date(self):
+        return timezone.now() - timezone.timedelta(
+            seconds=self.random.randint(0, self.days * 24 * 3600))
+
+    def create_users(self, count):
+        password = make_password('password')
+        prefix = 'seed_%s_' % self.run
+        User.objects.bulk_create(
+            [User(username='%s%d' % (prefix, i), password=password,
+                  email='%s%d@example.com' % (prefix, i))
+             for i in range(count)],
+            batch_size=self.batch_size,
+        )
+        return list(User.objects.filter(
+            username__startswith=prefix).order_by('id').values_list(
+            'id', flat=True))
+
+    def create_groups(self, count, users):
+        Group.objects.bulk_create(
+            [Group(title='Группа %s %d' % (self.run, i),
+                   slug=my_slugify('group %s %d' % (self.run, i)),
+                   description='Сгенерированная группа',
+                   author_id=self.random.choice(users))
+             for i in range(count)],
+            batch_size=self.batch_size,
+        )
+        return list(Group.objects.filter(
+            title__startswith='Группа %s ' % self.run).values_list(
+            'id', flat=True))
+
+    def create_images(self, count):
+        names = []
+        for i in range(count):
+            image = Image.new('RGB', (1280, 720), tuple(
+                self.random.randint(0, 255) for _ in range(3)))
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG')
+            # Через хранилище поля image: имя файла - хэш содержимого
+            field = Post._meta.get_field('image')
+            names.append(field.storage.save(
+                field.generate_filename(None, 'seed_%s_%d.jpg' % (self.run, i)),
+                ContentFile(buffer.getvalue())))
+        return names
+
+    def create_posts(self, count, users, weights, groups, images, ratio):
+        authors = self.random.choices(users, weights, k=count)
+        posts = []
+        for author in authors:
+            posts.append(Post(
+                text='Синтетическая запись %s' % uuid.uuid4().hex,
+                author_id=author,
+                group_id=(self.random.choice(groups)
+                          if groups and self.random.random() < 0.5 else None),
+                image=(self.random.choice(images)
+                       if images and self.random.random() < ratio else ''),
+                pub_date=self.random_date(),
+            ))
+        with manual_dates(Post._meta.get_field('pub_date')):
+            Post.objects.bulk_create(posts, batch_size=self.batch_size)
+        return list(Post.objects.filter(
+            author__username__startswith='seed_%s_' % self.run
+        ).values_list('id', 'author_id'))
+
+    def create_comments(self, count, users, posts, weights):
+        if not posts:
+            return
+        # Посты популярных авторов комментируют чаще
+        author_weight = dict(zip(users, weights))
+        post_weights = [author_weight.get(author, 0) for _, author in posts]
+        targets = self.random.choices(posts, post_weights, k=count)
+        comments = [
+            Comment(post_id=post_id, author_id=self.random.choice(users),
+                    text='Синтетический комментарий',
+                    created=self.random_date())
+            for post_id, _ in targets
+        ]
+        with manual_dates(Comment._meta.get_field('created')):
+            Comment.objects.bulk_create(comments, batch_size=self.batch_size)
+
+    def create_follows(self, count, users, weights):
+        if len(users) < 2:
+            return
+        pairs = set()
+        followings = self.random.choices(users, weights, k=count)
+        for following in followings:
+            user = self.random.choice(users)
+            if user != following:
+                pairs.add((user, following))
+        Follow.objects.bulk_create(
+            [Follow(user_id=user, following_id=following)
+             for user, following in pairs],
+            batch_size=self.batch_size, ignore_conflicts=True,
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.search import update_all_vectors, use_postgres
+
+
+class Command(BaseCommand):
+    help = 'Заполняет полнотекстовые векторы записей и групп'
+
+    def handle(self, *args, **options):
+        if not use_postgres():
+            self.stdout.write('Полнотекстовый индекс есть только в PostgreSQL')
+            return
+        update_all_vectors()
+        self.stdout.write(self.style.SUCCESS('Поисковые векторы обновлены'))
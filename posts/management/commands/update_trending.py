@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинг популярных записей и групп по новой активности'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Работать постоянно, пересчитывая раз в --sleep секунд')
+        parser.add_argument('--sleep', type=float, default=60)
+
+    def handle(self, *args, **options):
+        while True:
+            trending.update()
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
@@ -0,0 +1,248 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from . import profiling
+from .cache import get_versions
+
+
+logger = logging.getLogger('yatube.queries')
+
+# Накопленная статистика воркера по именам URL
+STATS = defaultdict(lambda: {'requests': 0, 'queries': 0, 'time': 0.0})
+
+# Попадания и промахи кэша страниц, еще не записанные в общий кэш:
+# запись в FileBasedCache на каждом попадании дороже самого попадания
+PAGE_CACHE_COUNTS = Counter()
+_counts_lock = threading.Lock()
+_counts_flushed = [time.monotonic()]
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    """
+    Обертка выполнения SQL, считающая число запросов и их время.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает SQL-запросы каждой страницы и сравнивает их
+    с бюджетом из settings.QUERY_BUDGETS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        match = request.resolver_match
+        url_name = match.url_name if match else None
+        if url_name is None:
+            return response
+        stats = STATS[url_name]
+        stats['requests'] += 1
+        stats['queries'] += counter.count
+        stats['time'] += counter.duration
+        logger.debug('%s: %d запросов, %.1f мс',
+                     url_name, counter.count, counter.duration * 1000)
+        if settings.DEBUG:
+            response['X-Query-Count'] = counter.count
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+        # Запросы профилировщика на сохранение отчета в бюджет не входят
+        if (budget is not None and counter.count > budget
+                and not getattr(request, 'profiled', False)):
+            message = 'Страница %s выполнила %d SQL-запросов при бюджете %d' % (
+                url_name, counter.count, budget)
+            if getattr(settings, 'QUERY_BUDGET_ACTION', 'warn') == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class ProfilerMiddleware:
+    """
+    Профилирует запрос сотрудника, если он передал ?_profile=1
+    или заголовок X-Profile. Отчет сохраняется в ProfileReport,
+    а с ?_profile=show возвращается вместо страницы.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = request.GET.get('_profile') or request.META.get('HTTP_X_PROFILE')
+        if not mode or not request.user.is_staff:
+            return self.get_response(request)
+        from .models import ProfileReport
+
+        request.profiled = True
+        with ExitStack() as stack:
+            report = stack.enter_context(profiling.profile())
+            recorder = profiling.current()
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        sql = report['breakdown'].get('sql', {'ms': 0, 'calls': 0})
+        match = request.resolver_match
+        saved = ProfileReport.objects.create(
+            user=request.user,
+            method=request.method,
+            path=request.get_full_path()[:2000],
+            url_name=(match.url_name or '') if match else '',
+            duration=report['duration'],
+            sql_count=sql['calls'],
+            sql_time=sql['ms'],
+            breakdown=profiling.dumps(report['breakdown']),
+            call_tree=report['call_tree'],
+        )
+        limit = getattr(settings, 'PROFILER_MAX_REPORTS', 200)
+        stale = ProfileReport.objects.order_by(
+            '-created', '-pk').values_list('pk', flat=True)[limit:limit + 100]
+        ProfileReport.objects.filter(pk__in=list(stale)).delete()
+        if mode == 'show':
+            return HttpResponse(
+                profiling.dumps(report['breakdown']) + '\n\n'
+                + report['call_tree'],
+                content_type='text/plain; charset=utf-8')
+        response['X-Profile-Report'] = saved.pk
+        return response
+
+
+class AnonymousPageCacheMiddleware:
+    """
+    Кэширует страницы целиком для посетителей без сессии.
+
+    Представление отмечает, от каких данных зависит страница
+    (tag_request), а в кэш вместе с ответом кладутся версии этих тегов.
+    Изменение данных меняет версии, и страница перестает совпадать.
+    Стоит до SessionMiddleware, чтобы попадание в кэш не трогало
+    сессии, CSRF и шаблоны.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        url_name = self.cacheable_url_name(request)
+        if url_name is None:
+            return self.get_response(request)
+        key = 'page:%s' % hashlib.md5(
+            request.get_full_path().encode()).hexdigest()
+        entry = cache.get(key)
+        if entry is not None:
+            tags, versions, response = entry
+            if get_versions(*tags) == versions:
+                count(url_name, 'hits')
+                response = get_conditional_response(
+                    request,
+                    etag=response.get('ETag'),
+                    last_modified=parse_http_date_safe(
+                        response.get('Last-Modified', '')),
+                    response=response,
+                )
+                response['X-Page-Cache'] = 'hit'
+                return response
+        count(url_name, 'misses')
+        request.cache_tags = set()
+        response = self.get_response(request)
+        if (request.cache_tags and response.status_code == 200
+                and not response.cookies and not response.streaming
+                and 'private' not in response.get('Cache-Control', '')):
+            tags = sorted(request.cache_tags)
+            cache.set(key, (tags, get_versions(*tags), response),
+                      getattr(settings, 'PAGE_CACHE_TIMEOUT', 600))
+        response['X-Page-Cache'] = 'miss'
+        return response
+
+    def cacheable_url_name(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if match.url_name not in getattr(settings, 'PAGE_CACHE_URL_NAMES', ()):
+            return None
+        return match.url_name
+
+
+def count(url_name, kind):
+    """
+    Увеличивает счетчик попаданий или промахов кэша страниц в памяти
+    воркера. В общий кэш счетчики уходят раз в PAGE_CACHE_STATS_FLUSH
+    секунд.
+    """
+    interval = getattr(settings, 'PAGE_CACHE_STATS_FLUSH', 10)
+    with _counts_lock:
+        PAGE_CACHE_COUNTS[(kind, url_name)] += 1
+        due = time.monotonic() - _counts_flushed[0] >= interval
+    if due:
+        flush_counts()
+
+
+def flush_counts():
+    """
+    Прибавляет накопленные воркером счетчики к общим в кэше.
+    """
+    with _counts_lock:
+        counts = dict(PAGE_CACHE_COUNTS)
+        PAGE_CACHE_COUNTS.clear()
+        _counts_flushed[0] = time.monotonic()
+    for (kind, url_name), value in counts.items():
+        key = 'page_cache:%s:%s' % (kind, url_name)
+        if not cache.add(key, value, None):
+            try:
+                cache.incr(key, value)
+            except ValueError:
+                cache.set(key, value, None)
+
+
+def page_cache_stats():
+    """
+    Попадания и промахи кэша страниц по именам URL.
+    """
+    flush_counts()
+    names = getattr(settings, 'PAGE_CACHE_URL_NAMES', ())
+    keys = ['page_cache:%s:%s' % (kind, name)
+            for name in names for kind in ('hits', 'misses')]
+    values = cache.get_many(keys)
+    return {
+        name: {
+            kind: values.get('page_cache:%s:%s' % (kind, name), 0)
+            for kind in ('hits', 'misses')
+        }
+        for name in names
+    }
@@ -1,11 +1,29 @@
+import datetime as dt
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 
-from .utils import my_slugify
+from .storage import post_images
+from .utils import unique_slug
 
 
 User = get_user_model()
 
+# Дата активности группы без записей: такие группы идут последними
+# в сортировке по активности
+NO_ACTIVITY = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+
+# Полнотекстовый поиск с GIN-индексом работает только в PostgreSQL
+POSTGRES = 'postgresql' in (settings.DATABASES['default'].get('ENGINE') or '')
+
+
+def search_indexes():
+    return [GinIndex(fields=['search_vector'])] if POSTGRES else []
+
 
 class Post(models.Model):
     text = models.TextField(verbose_name='Текст:')
@@ -15,7 +33,34 @@ class Post(models.Model):
     group = models.ForeignKey(
         'Group', on_delete=models.SET_NULL, blank=True, null=True, verbose_name='Категория:'
     )
-    image = models.ImageField(upload_to='posts/', blank=True, verbose_name='Изображение:')
+    # Имя файла - хэш содержимого, одинаковые картинки хранятся один раз
+    image = models.ImageField(upload_to='posts/', storage=post_images,
+                              blank=True, verbose_name='Изображение:')
+    comment_count = models.IntegerField(default=0, editable=False)
+    thumbnails_ready = models.BooleanField(default=False, editable=False)
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
+    # Меняется при любом изменении карточки записи, входит в ключ её кэша
+    version = models.IntegerField(default=1, editable=False)
+
+    class Meta:
+        indexes = search_indexes()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        # Увеличивается в базе: устаревший экземпляр не запишет
+        # уже использованный номер версии
+        self.version = models.F('version') + 1
+        super().save(*args, **kwargs)
+
+    def _save_table(self, *args, **kwargs):
+        updated = super()._save_table(*args, **kwargs)
+        # Новый номер читается сразу после UPDATE, до post_save:
+        # обработчики сигналов видят число, а не выражение
+        if isinstance(self.version, models.expressions.Combinable):
+            self.refresh_from_db(fields=['version'])
+        return updated
 
     def __str__(self):
         return self.text
@@ -26,10 +71,48 @@ class Group(models.Model):
     slug = models.SlugField(max_length=50, unique=True, verbose_name='URL')
     description = models.TextField(verbose_name='Описание')
     author = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
+    # Счетчики обновляются сигналами при изменении записей
+    posts_count = models.IntegerField(default=0, editable=False)
+    last_activity = models.DateTimeField(default=NO_ACTIVITY, editable=False)
+
+    class Meta:
+        indexes = search_indexes() + [
+            models.Index(fields=['-last_activity', '-id']),
+            models.Index(fields=['title', 'id']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        group = super().from_db(db, field_names, values)
+        # По ним save() поймет, менялось ли название, а сигналы -
+        # нужно ли обновлять карточки записей группы
+        group._loaded_title = group.__dict__.get('title')
+        group._loaded_slug = group.__dict__.get('slug')
+        return group
 
     def save(self, *args, **kwargs):
-        self.slug = my_slugify(self.title)
-        super().save(*args, **kwargs)
+        if self.pk is None:
+            source = self.slug or self.title
+        elif not self.slug or self.title != getattr(
+                self, '_loaded_title', None):
+            source = self.title
+        else:
+            super().save(*args, **kwargs)
+            self._loaded_slug = self.slug
+            return
+        # Одновременно созданная группа могла занять тот же slug
+        for attempt in range(3):
+            self.slug = unique_slug(source, exclude_pk=self.pk)
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                break
+            except IntegrityError:
+                if attempt == 2:
+                    raise
+        self._loaded_title = self.title
+        self._loaded_slug = self.slug
 
     def __str__(self):
         return self.title
@@ -41,6 +124,9 @@ class Comment(models.Model):
     text = models.TextField(verbose_name='Текст')
     created = models.DateTimeField("date published", auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['post', 'created'])]
+
     def __str__(self):
         return self.text
 
@@ -52,3 +138,137 @@ class Follow(models.Model):
     class Meta:
         unique_together = ('user', 'following')
 
+
+class TimelineEntry(models.Model):
+    """
+    Запись ленты избранных авторов, разложенная по подписчикам при публикации.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey('Post', on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [models.Index(fields=['user', '-pub_date', '-id'])]
+
+
+class UserStats(models.Model):
+    """
+    Счетчики пользователя, которые обновляются вместе с данными.
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    posts_count = models.IntegerField(default=0)
+    followers_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+
+
+class Job(models.Model):
+    """
+    Фоновая задача в очереди на базе данных.
+    """
+    PENDING = 'pending'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+    def __str__(self):
+        return '%s #%s' % (self.name, self.pk)
+
+
+class ProfileReport(models.Model):
+    """
+    Отчет профилировщика об одном запросе сотрудника.
+    """
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    url_name = models.CharField(max_length=100, blank=True)
+    duration = models.FloatField('Всего, мс')
+    sql_count = models.IntegerField('SQL-запросов')
+    sql_time = models.FloatField('SQL, мс')
+    breakdown = models.TextField('Разбивка времени')
+    call_tree = models.TextField('Дерево вызовов')
+
+    def __str__(self):
+        return '%s %s' % (self.method, self.path)
+
+
+class ImportedObject(models.Model):
+    """
+    Соответствие строки импорта созданному объекту. По нему импорт
+    находит записи для комментариев и пропускает уже загруженные строки.
+    """
+    source = models.CharField(max_length=100)
+    kind = models.CharField(max_length=20)
+    source_id = models.CharField(max_length=200)
+    object_id = models.IntegerField()
+
+    class Meta:
+        unique_together = ('source', 'kind', 'source_id')
+
+
+class ActivityBucket(models.Model):
+    """
+    Активность за один час: комментарии к записи или записи
+    и комментарии в группе. Из этих строк считается рейтинг популярного.
+    """
+    POST = 'post'
+    GROUP = 'group'
+
+    kind = models.CharField(max_length=5)
+    object_id = models.IntegerField()
+    hour = models.DateTimeField()
+    posts = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('kind', 'object_id', 'hour')
+        indexes = [models.Index(fields=['hour'])]
+
+
+class Trending(models.Model):
+    """
+    Готовый рейтинг популярных записей и групп для страниц.
+    """
+    kind = models.CharField(max_length=5)
+    object_id = models.IntegerField()
+    rank = models.IntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=['kind', 'rank'])]
+
+
+class Watermark(models.Model):
+    """
+    До какого id строки уже учтены периодической обработкой.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+
+class StoredFile(models.Model):
+    """
+    Сколько записей ссылается на файл картинки. Файл удаляется,
+    когда ссылок не остается.
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    refcount = models.IntegerField(default=0)
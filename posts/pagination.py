@@ -0,0 +1,331 @@
+import base64
+import binascii
+import datetime as dt
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+
+# Сколько первых страниц ещё открываются по старым ссылкам вида ?page=N
+LEGACY_PAGE_LIMIT = 5
+
+# До какого размера таблицы COUNT(*) считается точно на каждый запрос
+EXACT_COUNT_LIMIT = 10000
+# Сколько секунд хранится точное число строк отфильтрованной выборки
+COUNT_CACHE_TIMEOUT = 300
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, key, value, pk):
+    """
+    Упаковывает ключ (значение поля сортировки, id) в непрозрачную строку.
+    Имя поля сортировки тоже входит в курсор: курсор другой сортировки
+    к ленте не подходит.
+    """
+    if isinstance(value, dt.datetime):
+        value = value.isoformat()
+    raw = json.dumps([direction, key, value, pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Распаковывает курсор в (направление, поле, значение, id). Значение
+    остаётся строкой или числом из JSON, его приводит к типу поля
+    пагинатор. Для испорченного курсора возвращает None.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, key, value, pk = json.loads(raw.decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        return None
+    if direction not in (NEXT, PREVIOUS) or not isinstance(key, str):
+        return None
+    if isinstance(pk, bool) or not isinstance(pk, int):
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return None
+    return direction, key, value, pk
+
+
+class CursorPage:
+    """
+    Страница ленты, полученная по курсору, без подсчёта всех записей.
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None,
+                 cursor=None, number=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.cursor = cursor
+        self.number = number
+        self.params = ''
+
+    def __repr__(self):
+        return '<Page %s>' % (self.cursor or self.number or 1)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Постраничный вывод по ключу (key, id) вместо OFFSET и COUNT(*).
+
+    Каждая страница - это один запрос по индексу поля key
+    с LIMIT per_page + 1: лишняя запись говорит, есть ли следующая страница.
+    """
+
+    def __init__(self, queryset, per_page, key='pub_date', descending=True,
+                 legacy_page_limit=LEGACY_PAGE_LIMIT):
+        self.key = key
+        self.descending = descending
+        self.per_page = per_page
+        self.legacy_page_limit = legacy_page_limit
+        order = ('-%s' if descending else '%s')
+        self.queryset = queryset.order_by(order % key, order % 'id')
+
+    def _after(self, value, pk, forward=True):
+        """
+        Условие "запись идёт после ключа" в порядке ленты
+        (или перед ним, если forward=False).
+        """
+        lookup = 'lt' if self.descending == forward else 'gt'
+        return (
+            Q(**{'%s__%s' % (self.key, lookup): value})
+            | Q(**{self.key: value, 'id__%s' % lookup: pk})
+        )
+
+    def _cursor(self, direction, obj):
+        return encode_cursor(direction, self.key, getattr(obj, self.key),
+                             obj.pk)
+
+    def _field(self):
+        annotation = self.queryset.query.annotations.get(self.key)
+        if annotation is not None:
+            return annotation.output_field
+        return self.queryset.model._meta.get_field(self.key)
+
+    def _decode(self, cursor):
+        """
+        Курсор этой ленты со значением, приведённым к типу поля
+        сортировки, или None, если курсор испорчен или от другой ленты.
+        """
+        decoded = decode_cursor(cursor)
+        if decoded is None:
+            return None
+        direction, key, value, pk = decoded
+        if key != self.key:
+            return None
+        try:
+            value = self._field().to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            return None
+        if value is None or (isinstance(value, dt.datetime)
+                             and timezone.is_naive(value)):
+            return None
+        return direction, value, pk
+
+    def _page(self, items, has_next, has_previous, cursor=None, number=None):
+        return CursorPage(
+            items,
+            next_cursor=(self._cursor(NEXT, items[-1])
+                         if has_next and items else None),
+            previous_cursor=(self._cursor(PREVIOUS, items[0])
+                             if has_previous and items else None),
+            cursor=cursor,
+            number=number,
+        )
+
+    def first_page(self):
+        items = list(self.queryset[:self.per_page + 1])
+        return self._page(items[:self.per_page], len(items) > self.per_page,
+                          False)
+
+    def get_page(self, cursor=None, page_number=None):
+        """
+        Возвращает страницу по курсору. Старые ссылки ?page=N работают
+        для первых legacy_page_limit страниц, остальное ведёт на первую.
+        """
+        if cursor:
+            decoded = self._decode(cursor)
+            if decoded is not None:
+                return self._cursor_page(cursor, *decoded)
+        if page_number:
+            try:
+                number = int(page_number)
+            except (TypeError, ValueError):
+                number = 1
+            if 1 < number <= self.legacy_page_limit:
+                return self._numbered_page(number)
+        return self.first_page()
+
+    def _cursor_page(self, cursor, direction, value, pk):
+        if direction == NEXT:
+            items = list(
+                self.queryset.filter(self._after(value, pk))[:self.per_page + 1]
+            )
+            return self._page(items[:self.per_page],
+                              len(items) > self.per_page, True, cursor=cursor)
+        items = list(
+            self.queryset.filter(
+                self._after(value, pk, forward=False)
+            ).reverse()[:self.per_page + 1]
+        )
+        if len(items) <= self.per_page:
+            # Дошли до начала ленты - показываем свежую первую страницу
+            return self.first_page()
+        items = items[:self.per_page][::-1]
+        return self._page(items, True, True, cursor=cursor)
+
+    def _numbered_page(self, number):
+        offset = (number - 1) * self.per_page
+        items = list(self.queryset[offset:offset + self.per_page + 1])
+        if not items:
+            return self.first_page()
+        return self._page(items[:self.per_page], len(items) > self.per_page,
+                          True, number=number)
+
+
+def estimated_count(queryset):
+    """
+    Число строк таблицы по статистике планировщика PostgreSQL (reltuples)
+    для выборки без условий. В остальных случаях возвращает None.
+    """
+    query = queryset.query
+    if (query.where or query.distinct or query.combinator
+            or query.low_mark or query.high_mark is not None):
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    # -1 у таблицы, для которой ANALYZE ещё не запускался
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+def cached_count(queryset, timeout=COUNT_CACHE_TIMEOUT):
+    """
+    Точный COUNT(*) выборки, запомненный в кэше на timeout секунд.
+    """
+    sql, params = queryset.query.sql_with_params()
+    key = 'count:%s' % hashlib.md5(
+        repr((queryset.db, sql, params)).encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class WindowedPage(Page):
+    """
+    Страница, которая знает, есть ли следующая, без точного числа строк.
+    """
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def end_index(self):
+        return (self.number - 1) * self.paginator.per_page + len(self)
+
+
+class WindowedPaginator(Paginator):
+    """
+    Постраничный вывод для больших таблиц.
+
+    Число строк у таблицы без условий берётся из статистики планировщика,
+    точный COUNT(*) выполняется, только если таблица небольшая, а для
+    отфильтрованных выборок запоминается в кэше. Страница читает
+    per_page + 1 строк, поэтому ссылка "Следующая" верна и при неточном
+    числе строк.
+    """
+
+    def __init__(self, *args, exact_count_limit=EXACT_COUNT_LIMIT,
+                 count_timeout=COUNT_CACHE_TIMEOUT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exact_count_limit = exact_count_limit
+        self.count_timeout = count_timeout
+        self.estimated = False
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return len(self.object_list)
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate > self.exact_count_limit:
+            self.estimated = True
+            return estimate
+        if estimate is not None:
+            return self.object_list.count()
+        return cached_count(self.object_list, self.count_timeout)
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # Оценка могла оказаться меньше настоящего числа строк
+            if self.count and self.estimated:
+                return int(number)
+            raise
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        items = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not items and number > 1:
+            raise EmptyPage('That page contains no results')
+        return WindowedPage(items[:self.per_page], number, self,
+                            len(items) > self.per_page)
+
+
+def get_cursor_page(request, queryset, per_page, **kwargs):
+    """
+    Страница ленты по параметрам запроса ?cursor= или устаревшему ?page=.
+    """
+    paginator = CursorPaginator(queryset, per_page, **kwargs)
+    page = paginator.get_page(
+        cursor=request.GET.get('cursor'),
+        page_number=request.GET.get('page'),
+    )
+    # Остальные параметры запроса сохраняются в ссылках на соседние страницы
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    params.pop('page', None)
+    page.params = params.urlencode() + '&' if params else ''
+    return page
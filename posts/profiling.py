@@ -0,0 +1,178 @@
+import cProfile
+import json
+import pstats
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from django.template.base import Template
+from sorl.thumbnail.base import ThumbnailBackend
+
+
+_local = threading.local()
+
+
+class Recorder:
+    """
+    Делит время запроса на участки: код представления, SQL,
+    отрисовку отдельных шаблонов и нарезку миниатюр.
+
+    Время участка собственное: вложенные участки из него вычитаются.
+    """
+
+    def __init__(self):
+        self.stack = ['view']
+        self.own = defaultdict(float)
+        self.calls = Counter()
+        self.mark = time.perf_counter()
+
+    def _flush(self):
+        now = time.perf_counter()
+        self.own[self.stack[-1]] += now - self.mark
+        self.mark = now
+
+    @contextmanager
+    def section(self, name):
+        self._flush()
+        self.stack.append(name)
+        self.calls[name] += 1
+        try:
+            yield
+        finally:
+            self._flush()
+            self.stack.pop()
+
+    def finish(self):
+        self._flush()
+        return {
+            name: {'ms': round(seconds * 1000, 3), 'calls': self.calls[name]}
+            for name, seconds in sorted(
+                self.own.items(), key=lambda item: -item[1])
+        }
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.section('sql'):
+            return execute(sql, params, many, context)
+
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+
+def _timed(method, name_of):
+    """
+    Оборачивает метод так, чтобы его время попадало в отдельный участок.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        recorder = current()
+        if recorder is None:
+            return method(self, *args, **kwargs)
+        with recorder.section(name_of(self)):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# Методы, время которых выделяется в отдельные участки
+TIMED = (
+    (Template, 'render',
+     lambda template: 'template:%s' % (template.origin.template_name
+                                       or template.name)),
+    (ThumbnailBackend, 'get_thumbnail', lambda backend: 'thumbnail'),
+)
+
+_patch_lock = threading.Lock()
+_patched = {'count': 0, 'originals': {}}
+
+
+def _patch():
+    """
+    Подменяет методы из TIMED, пока идет хотя бы одно профилирование.
+    """
+    with _patch_lock:
+        if not _patched['count']:
+            for cls, name, name_of in TIMED:
+                method = cls.__dict__[name]
+                _patched['originals'][(cls, name)] = method
+                setattr(cls, name, _timed(method, name_of))
+        _patched['count'] += 1
+
+
+def _unpatch():
+    with _patch_lock:
+        _patched['count'] -= 1
+        if not _patched['count']:
+            for (cls, name), method in _patched['originals'].items():
+                setattr(cls, name, method)
+            _patched['originals'].clear()
+
+
+def call_tree(profiler, max_depth=80, min_share=0.01):
+    """
+    Дерево вызовов по данным cProfile: у каждой функции - вызванные
+    из неё, по убыванию общего времени. Ветки короче min_share
+    от всего времени не выводятся, а вызовы функции раскрываются
+    только в первом (самом тяжелом) месте дерева.
+    """
+    stats = pstats.Stats(profiler).stats
+    callees = defaultdict(list)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, (_, calls, _, cumulative) in callers.items():
+            callees[caller].append((cumulative, calls, func))
+    # Самая долгая функция - корень дерева. Вызывающих ищем не по
+    # статистике: цепочка middleware зациклена (inner -> __call__ -> inner)
+    order = sorted(stats, key=lambda func: -stats[func][3])
+    total = stats[order[0]][3] if order else 0
+    lines = []
+    expanded = set()
+    for root in order:
+        if stats[root][3] < total * min_share:
+            break
+        if root in expanded:
+            continue
+        # Обход в глубину через явный стек: рекурсия шаблонов глубокая
+        stack = [(stats[root][3], stats[root][1], root, 0)]
+        while stack:
+            cumulative, calls, func, depth = stack.pop()
+            if cumulative < total * min_share:
+                continue
+            lines.append('%s%.1f ms  %dx  %s' % (
+                '  ' * depth, cumulative * 1000, calls,
+                pstats.func_std_string(func)))
+            if func in expanded or depth >= max_depth:
+                continue
+            expanded.add(func)
+            stack.extend((child_time, child_calls, child, depth + 1)
+                         for child_time, child_calls, child
+                         in sorted(callees[func], key=lambda item: item[0]))
+    return '\n'.join(lines)
+
+
+@contextmanager
+def profile():
+    """
+    Профилирует блок кода. Отдает словарь, который после выхода
+    содержит разбивку времени и дерево вызовов.
+    """
+    report = {}
+    recorder = Recorder()
+    profiler = cProfile.Profile()
+    _patch()
+    _local.recorder = recorder
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield report
+    finally:
+        profiler.disable()
+        _local.recorder = None
+        _unpatch()
+        report['duration'] = (time.perf_counter() - start) * 1000
+        report['breakdown'] = recorder.finish()
+        report['call_tree'] = call_tree(profiler)
+
+
+def dumps(breakdown):
+    return json.dumps(breakdown, ensure_ascii=False, indent=2)
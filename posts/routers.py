@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+# Чтение идет с основной базы, пока в этом потоке выставлен признак
+_state = threading.local()
+
+# Приложения, чтение моделей которых можно отдавать репликам.
+# Сессии и прочее служебное всегда читаются с основной базы
+REPLICA_APPS = {'posts', 'auth'}
+
+
+def pin_to_primary():
+    """
+    Направляет чтение текущего запроса на основную базу.
+    """
+    _state.pinned = True
+
+
+def unpin():
+    _state.pinned = False
+    _state.wrote = False
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+def pin_if_recent(versions):
+    """
+    Версии кэша - это время изменения данных. Если данные менялись
+    меньше REPLICA_PIN_SECONDS назад, реплика может их еще не знать,
+    и страница, собранная с нее, легла бы в кэш под новой версией.
+    Поэтому такой запрос читает с основной базы. Версии нужно получить
+    до чтения данных, как это делают conditional_page и {% cache %}.
+    """
+    if not versions or not getattr(settings, 'REPLICA_DATABASES', []):
+        return
+    lag = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+    if max(versions) > time.time() - lag:
+        pin_to_primary()
+
+
+def _note_writes(execute, sql, params, many, context):
+    """
+    Закрепляет чтение за основной базой после настоящей записи.
+    get_or_create и select_for_update тоже идут через db_for_write,
+    но, если ничего не вставили, чтение не закрепляют.
+    """
+    if sql.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+        pin_to_primary()
+        _state.wrote = True
+    return execute(sql, params, many, context)
+
+
+class ReplicaRouter:
+    """
+    Пишет в основную базу, читает со случайной реплики из
+    settings.REPLICA_DATABASES.
+
+    Чтобы пользователь сразу видел свою запись, после записи чтение
+    закрепляется за основной базой: до конца запроса и на несколько
+    секунд после него - через PrimaryPinMiddleware. Внутри транзакции
+    чтение тоже идет с основной базы.
+
+    REPLICA_PIN_SECONDS считается верхней границей отставания реплик:
+    по ней же pin_if_recent решает, можно ли собирать с реплики
+    страницу для кэша с только что смененной версией.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'REPLICA_DATABASES', [])
+        if (not replicas or is_pinned()
+                or model._meta.app_label not in REPLICA_APPS
+                or connections['default'].in_atomic_block):
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *getattr(settings, 'REPLICA_DATABASES', [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема приходит на реплики вместе с репликацией
+        return db == 'default'
+
+
+class PrimaryPinMiddleware:
+    """
+    Закрепляет чтение за основной базой на время запроса, меняющего
+    данные, и на REPLICA_PIN_SECONDS после записи, пока реплики догоняют.
+    Запись бывает и в GET-запросах (подписка по ссылке), поэтому кука
+    ставится по факту записи, а не по методу.
+    """
+    cookie_name = 'primary_pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        unpin()
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            pin_to_primary()
+        else:
+            try:
+                until = float(request.COOKIES.get(self.cookie_name, 0))
+            except ValueError:
+                until = 0
+            if until > time.time():
+                pin_to_primary()
+        try:
+            with connections['default'].execute_wrapper(_note_writes):
+                response = self.get_response(request)
+            if (getattr(settings, 'REPLICA_DATABASES', [])
+                    and getattr(_state, 'wrote', False)):
+                seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+                response.set_cookie(
+                    self.cookie_name, str(time.time() + seconds),
+                    max_age=seconds, httponly=True, samesite='Lax')
+            return response
+        finally:
+            unpin()
@@ -0,0 +1,88 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+
+from .models import Group, Post
+from .utils import chunks
+
+
+# Конфигурация словарей PostgreSQL для русского текста
+CONFIG = 'russian'
+
+POST_VECTOR = SearchVector('text', config=CONFIG)
+GROUP_VECTOR = (
+    SearchVector('title', weight='A', config=CONFIG)
+    + SearchVector('description', weight='B', config=CONFIG)
+)
+
+
+def use_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def update_post_vector(post_id):
+    if use_postgres():
+        Post.objects.filter(pk=post_id).update(search_vector=POST_VECTOR)
+
+
+def update_group_vector(group_id):
+    if use_postgres():
+        Group.objects.filter(pk=group_id).update(search_vector=GROUP_VECTOR)
+
+
+def update_all_vectors(post_ids=None, group_ids=None):
+    """
+    Заполняет поисковые векторы записей и групп: всех или только
+    перечисленных.
+    """
+    if not use_postgres():
+        return
+    for ids in chunks(post_ids):
+        posts = Post.objects.all() if ids is None else Post.objects.filter(
+            pk__in=ids)
+        posts.update(search_vector=POST_VECTOR)
+    for ids in chunks(group_ids):
+        groups = Group.objects.all() if ids is None else Group.objects.filter(
+            pk__in=ids)
+        groups.update(search_vector=GROUP_VECTOR)
+
+
+def _fallback_filter(queryset, query, fields):
+    """
+    Поиск без tsvector для SQLite: каждое слово должно встретиться
+    хотя бы в одном из полей, без учета регистра.
+    """
+    for word in query.split():
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{'%s__iregex' % field: re.escape(word)})
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def filter_posts(queryset, query):
+    """
+    Оставляет записи, подходящие под запрос, и добавляет их ранг rank.
+    Возвращает queryset и поле, по которому результаты упорядочены.
+    """
+    if use_postgres():
+        search_query = SearchQuery(query, config=CONFIG)
+        # ts_rank возвращает real, приводим к double для точных курсоров
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=Cast(SearchRank(F('search_vector'), search_query),
+                      FloatField())
+        ), 'rank'
+    return _fallback_filter(queryset, query, ['text']), 'pub_date'
+
+
+def filter_groups(queryset, query):
+    if use_postgres():
+        search_query = SearchQuery(query, config=CONFIG)
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank')
+    return _fallback_filter(
+        queryset, query, ['title', 'description']).order_by('title')
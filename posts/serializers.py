@@ -0,0 +1,33 @@
+def post_data(post):
+    """
+    Поля записи для API. Автор и группа должны быть подгружены заранее.
+    """
+    return {
+        'id': post.id,
+        'text': post.text,
+        'pub_date': post.pub_date,
+        'author': post.author.username,
+        'group': post.group.slug if post.group_id else None,
+        'image': post.image.url if post.image else None,
+        'comment_count': post.comment_count,
+    }
+
+
+def comment_data(comment):
+    return {
+        'id': comment.id,
+        'author': comment.author.username,
+        'text': comment.text,
+        'created': comment.created,
+    }
+
+
+def page_data(page, serializer):
+    """
+    Страница ленты с курсорами соседних страниц.
+    """
+    return {
+        'results': [serializer(item) for item in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
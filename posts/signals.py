@@ -0,0 +1,186 @@
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import timeline
+from .cache import (FEED, bump_version, feed_tag, group_tag, post_tag,
+                    user_version)
+from .counters import (change_comment_count, change_stats, group_post_added,
+                       group_post_removed)
+from .jobs import enqueue
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .search import update_group_vector, update_post_vector
+from .storage import acquire, release
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_feed(sender, **kwargs):
+    """
+    Сбрасывает закэшированные страницы лент после изменения данных.
+    """
+    bump_version(FEED)
+
+
+@receiver(pre_save, sender=Post)
+def remember_group(sender, instance, raw=False, **kwargs):
+    # Прежняя группа нужна, чтобы сбросить её ленту при переносе записи,
+    # прежняя картинка - чтобы снять с её файла ссылку
+    instance._old_group_id = None
+    instance._old_image = ''
+    if instance.pk and not raw:
+        row = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'image').first()
+        if row:
+            instance._old_group_id, instance._old_image = row
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    tags = [
+        post_tag(instance.pk),
+        feed_tag('index'),
+        feed_tag('author', instance.author_id),
+        user_version(instance.author_id),
+    ]
+    old_group_id = getattr(instance, '_old_group_id', None)
+    for group_id in {instance.group_id, old_group_id}:
+        if group_id:
+            tags.append(feed_tag('group', group_id))
+    bump_version(*tags)
+
+
+@receiver(post_save, sender=Post)
+def count_image_refs(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    image = instance.image.name or ''
+    old_image = getattr(instance, '_old_image', '')
+    if image != old_image:
+        acquire(image)
+        release(old_image)
+        instance._old_image = image
+
+
+@receiver(post_delete, sender=Post)
+def release_image(sender, instance, **kwargs):
+    release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    bump_version(post_tag(instance.post_id))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_pages(sender, instance, **kwargs):
+    bump_version(group_tag(instance.pk))
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        change_comment_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    change_comment_count(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        change_stats(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    change_stats(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def post_group_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_group_id = getattr(instance, '_old_group_id', None)
+    if not created and old_group_id == instance.group_id:
+        return
+    if old_group_id:
+        group_post_removed(old_group_id)
+    if instance.group_id:
+        group_post_added(instance.group_id, instance.pub_date)
+
+
+@receiver(post_delete, sender=Post)
+def post_group_deleted(sender, instance, **kwargs):
+    if instance.group_id:
+        group_post_removed(instance.group_id)
+
+
+@receiver(post_save, sender=Post)
+def post_fan_out(sender, instance, created, raw=False, **kwargs):
+    # Запись раскладывается по лентам подписчиков фоновой задачей; строки
+    # лент удаленной записи убирает каскадное удаление TimelineEntry
+    if created and not raw:
+        enqueue('fan_out', post_id=instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created:
+        change_stats(instance.following_id, followers_count=1)
+        change_stats(instance.user_id, following_count=1)
+        bump_version(user_version(instance.following_id),
+                     user_version(instance.user_id))
+        if not raw:
+            enqueue('backfill_timeline', user_id=instance.user_id,
+                    author_id=instance.following_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    change_stats(instance.following_id, followers_count=-1)
+    change_stats(instance.user_id, following_count=-1)
+    bump_version(user_version(instance.following_id),
+                 user_version(instance.user_id))
+    timeline.remove(instance.user_id, instance.following_id)
+
+
+@receiver(post_save, sender=Post)
+def post_search_vector(sender, instance, **kwargs):
+    update_post_vector(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+def group_search_vector(sender, instance, **kwargs):
+    update_group_vector(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, created=False, **kwargs):
+    # Карточки записей показывают название и ссылку на группу, так что
+    # правка одного описания их не касается
+    if created:
+        return
+    if kwargs['signal'] is post_save and (
+            getattr(instance, '_loaded_title', None),
+            getattr(instance, '_loaded_slug', None),
+    ) == (instance.title, instance.slug):
+        return
+    Post.objects.filter(group=instance).update(version=F('version') + 1)
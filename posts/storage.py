@@ -0,0 +1,120 @@
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F
+from sorl.thumbnail import delete as delete_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, в котором имя файла - это SHA-256 его содержимого.
+
+    Одинаковые загрузки получают одно имя и один файл на диске, а значит
+    и общий набор миниатюр sorl. Существующий файл повторно не пишется.
+    """
+
+    def _save(self, name, content):
+        digest = self.digest(content)
+        directory = os.path.dirname(name)
+        ext = os.path.splitext(name)[1].lower()
+        name = os.path.join(directory, digest[:2], digest + ext)
+        if self.exists(name):
+            return name
+        # Такое же содержимое могут сохранять одновременно, и тогда
+        # FileSystemStorage._save бесконечно повторял бы запись под тем же
+        # именем. Файл пишется под временным именем и атомарно переименовывается:
+        # победит любая из одинаковых копий
+        temp = super()._save('%s.%s.tmp' % (name, uuid.uuid4().hex), content)
+        os.replace(self.path(temp), self.path(name))
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым в _save, суффиксы не нужны
+        return name
+
+    @staticmethod
+    def digest(content):
+        sha = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            sha.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        return sha.hexdigest()
+
+
+post_images = ContentAddressedStorage()
+
+
+def acquire(name):
+    """
+    Запись начала ссылаться на файл name.
+    """
+    from .models import StoredFile
+    if not name:
+        return
+    updated = StoredFile.objects.filter(name=name).update(
+        refcount=F('refcount') + 1)
+    if not updated:
+        _, created = StoredFile.objects.get_or_create(
+            name=name, defaults={'refcount': 1})
+        if not created:
+            StoredFile.objects.filter(name=name).update(
+                refcount=F('refcount') + 1)
+
+
+def release(name):
+    """
+    Запись перестала ссылаться на файл name. Когда ссылок не осталось,
+    файл и его миниатюры удаляются после фиксации транзакции.
+    """
+    from .models import StoredFile
+    if not name:
+        return
+    StoredFile.objects.filter(name=name).update(refcount=F('refcount') - 1)
+    deleted, _ = StoredFile.objects.filter(name=name, refcount__lte=0).delete()
+    if deleted:
+        transaction.on_commit(lambda: remove(name))
+
+
+def remove(name):
+    """
+    Удаляет файл с миниатюрами, если за это время на него
+    снова никто не сослался.
+    """
+    from .models import StoredFile
+    if StoredFile.objects.filter(name=name).exists():
+        return
+    delete_thumbnails(ImageFile(name, storage=post_images))
+
+
+def reconcile(names=None):
+    """
+    Пересчитывает счетчики ссылок по записям: для всех файлов или только
+    для names. Нужно после импорта и для файлов, загруженных до появления
+    счетчиков.
+    """
+    from .models import Post, StoredFile
+    posts = Post.objects.exclude(image='')
+    files = StoredFile.objects.all()
+    if names is not None:
+        posts = posts.filter(image__in=list(names))
+        files = files.filter(name__in=list(names))
+    counts = dict(posts.values_list(
+        'image').annotate(n=Count('id')).order_by())
+    with transaction.atomic():
+        files.exclude(name__in=list(counts)).delete()
+        existing = dict(files.values_list('name', 'refcount'))
+        for name, count in counts.items():
+            if name in existing and existing[name] != count:
+                StoredFile.objects.filter(name=name).update(refcount=count)
+        StoredFile.objects.bulk_create([
+            StoredFile(name=name, refcount=count)
+            for name, count in counts.items() if name not in existing
+        ])
+    return len(counts)
@@ -0,0 +1,46 @@
+from django.core import mail
+
+from .cache import FEED, bump_version
+from .jobs import task
+from .models import Follow, Post
+from . import thumbnails, timeline, trending
+
+
+@task('send_mail')
+def send_mail(subject, message, from_email, recipient_list):
+    mail.send_mail(subject, message, from_email, recipient_list)
+
+
+@task('generate_thumbnails')
+def generate_thumbnails(post_id):
+    post = Post.objects.filter(pk=post_id).only('id', 'image').first()
+    if post is not None:
+        thumbnails.generate(post)
+        bump_version(FEED)
+
+
+@task('fan_out')
+def fan_out(post_id):
+    post = Post.objects.filter(pk=post_id).only(
+        'id', 'author_id', 'pub_date').first()
+    if post is not None:
+        timeline.fan_out(post)
+        # Версии лент сброшены при сохранении записи, до раскладки
+        bump_version(FEED)
+
+
+@task('backfill_timeline')
+def backfill_timeline(user_id, author_id):
+    # Пользователь мог отписаться, пока задача ждала в очереди
+    if Follow.objects.filter(user=user_id, following=author_id).exists():
+        timeline.backfill(user_id, author_id)
+
+
+@task('bump_cache_version')
+def bump_cache_version(names):
+    bump_version(*names)
+
+
+@task('update_trending')
+def update_trending():
+    trending.update()
@@ -0,0 +1,72 @@
+import re
+
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+
+register = template.Library()
+
+# Место в закэшированной карточке для ссылок, зависящих от зрителя
+ACTIONS_MARKER = '<!-- post-actions -->'
+# Такое же место внутри общего для всех фрагмента: id записи и автора
+DEFERRED_ACTIONS = '<!-- post-actions:%s:%s -->'
+DEFERRED_ACTIONS_RE = re.compile(r'<!-- post-actions:(\d+):(\d+) -->')
+
+CARD_TIMEOUT = 60 * 60 * 24
+
+
+@register.simple_tag(takes_context=True)
+def post_card(context, post, post_detail=False):
+    """
+    Отрисовывает карточку записи из кэша по ключу (id, версия, вариант).
+    Для каждого запроса дорисовываются только ссылки автора.
+    """
+    variant = 'detail' if post_detail else 'feed'
+    key = 'post_card:%s:%s:%s' % (post.pk, post.version, variant)
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string(
+            'posts/post_card.html',
+            {'post': post, 'post_detail': post_detail}
+        )
+        cache.set(key, html, CARD_TIMEOUT)
+    if context.get('defer_post_actions'):
+        actions = DEFERRED_ACTIONS % (post.pk, post.author_id)
+    else:
+        actions = _actions(context.get('user'), post.pk, post.author_id)
+    return mark_safe(html.replace(ACTIONS_MARKER, actions))
+
+
+def _actions(user, post_id, author_id):
+    if user is None or user.pk is None or user.pk != author_id:
+        return ''
+    # Зритель и есть автор, поэтому запись для ссылок не загружается
+    return render_to_string('posts/post_actions.html', {
+        'post': {'id': post_id, 'author': user}})
+
+
+class ViewerActionsNode(template.Node):
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        with context.push(defer_post_actions=True):
+            html = self.nodelist.render(context)
+        user = context.get('user')
+        return mark_safe(DEFERRED_ACTIONS_RE.sub(
+            lambda match: _actions(user, int(match.group(1)),
+                                   int(match.group(2))),
+            html))
+
+
+@register.tag
+def viewer_actions(parser, token):
+    """
+    Блок, общий для всех зрителей (например, {% cache %} ленты): карточки
+    внутри оставляют метки, и ссылки автора подставляются уже после кэша.
+    """
+    nodelist = parser.parse(('endviewer_actions',))
+    parser.delete_first_token()
+    return ViewerActionsNode(nodelist)
@@ -1,9 +1,41 @@
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
 from django.core import mail
 from django.core.cache import cache
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections as db_connections
+from django.db.models.signals import post_save
+from django.http import HttpResponse
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.models import Session
+from django.test import (RequestFactory, TestCase, TransactionTestCase,
+                         override_settings)
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 
-from .models import Post, User, Group
+from . import (benchmark, connections, importer, jobs, middleware,
+               pagination, routers, storage, timeline, trending)
+from .cache import FEED, bump_version, get_version, get_versions, group_tag
+from .utils import my_slugify
+from .middleware import QueryBudgetExceeded
+from .models import (NO_ACTIVITY, ActivityBucket, Comment, Follow, Job, Post,
+                     ProfileReport, StoredFile, User, Group, TimelineEntry,
+                     UserStats, Watermark)
 
 # Данные для регистрации
 signup_data = {
@@ -16,10 +48,35 @@ signup_data = {
 }
 
 
+def make_image(name='image.jpg', size=(300, 200), color=(30, 120, 200)):
+    """Картинка JPEG для загрузки, созданная в памяти"""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), 'image/jpeg')
+
+
+class TempMediaMixin:
+    """Загрузки и миниатюры пишутся во временный MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        self.media_settings.enable()
+
+    def tearDown(self):
+        self.media_settings.disable()
+        self.media.cleanup()
+        super().tearDown()
+
+
 class TestEmail(TestCase):
     def test_send_email(self):
         # Регистрируемся
         self.client.post(reverse('signup'), signup_data)
+        # Письмо уходит не в запросе, а фоновым обработчиком
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('run_jobs', '--once')
         # Проверяем, что письмо лежит в исходящих
         self.assertEqual(len(mail.outbox), 1)
         # Проверяем, что тема первого письма правильная.
@@ -146,8 +203,9 @@ class TestErrorsPages(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
-class TestImage(TestCase):
+class TestImage(TempMediaMixin, TestCase):
     def setUp(self):
+        super().setUp()
         # Очищаем кэш
         cache.clear()
         # Создаем пользователя
@@ -159,12 +217,11 @@ class TestImage(TestCase):
         # Логинемся
         self.client.login(username='nikita', password='12345')
         # Создаем пост с картинкой
-        with open('media/posts/bb6fbe32.jpg', 'rb') as f_obj:
-            self.client.post(
-                reverse('new_post'),
-                {'text': 'Text', 'image': f_obj,
-                 'group': self.group.id}
-            )
+        self.client.post(
+            reverse('new_post'),
+            {'text': 'Text', 'image': make_image(),
+             'group': self.group.id}
+        )
 
     def test_image_everywhere(self):
         """Проверяет, что картинка есть на всех
@@ -212,6 +269,7 @@ class TestImage(TestCase):
 
 class TestCache(TestCase):
     def setUp(self):
+        cache.clear()
         self.client.get(reverse('index'))
         user = User.objects.create_user(
             username="nikita", email="nikita@example.com", password="12345")
@@ -219,18 +277,47 @@ class TestCache(TestCase):
         self.client.post(reverse('new_post'), {'text': 'Тест кэша'})
 
     def test_cache(self):
+        """Проверяет, что новый пост сразу сбрасывает кэш ленты"""
         response = self.client.get(reverse('index'))
-        self.assertNotContains(
+        self.assertContains(
             response, 'Тест кэша',
+            status_code=200, count=1, msg_prefix='Пост не найден', html=False
+        )
+
+    def test_cache_is_used(self):
+        """Проверяет, что без сигналов лента отдается из кэша"""
+        self.client.get(reverse('index'))
+        # update() не отправляет сигналы, версия кэша не меняется
+        Post.objects.update(text='Изменено в обход сигналов')
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(
+            response, 'Изменено в обход сигналов',
             status_code=200, msg_prefix='Пост найден, а не должен', html=False
         )
         cache.clear()
         response = self.client.get(reverse('index'))
         self.assertContains(
-            response, 'Тест кэша',
+            response, 'Изменено в обход сигналов',
             status_code=200, count=1, msg_prefix='Пост не найден', html=False
         )
 
+    def test_author_links_not_shared(self):
+        """Проверяет, что закэшированная лента не показывает ссылки
+        автора другим пользователям и анонимам
+        """
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Редактировать', count=1)
+        User.objects.create_user(username="ivan", password="12345")
+        self.client.login(username='ivan', password='12345')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Тест кэша', count=1)
+        self.assertNotContains(response, 'Редактировать')
+        self.client.logout()
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Тест кэша', count=1)
+        self.assertNotContains(response, 'Редактировать')
+        self.assertNotContains(response, 'post-actions')
+
 
 class TestFollow(TestCase):
     def setUp(self):
@@ -279,6 +366,7 @@ class TestFollow(TestCase):
         # Подписываемся и проверяем наличие поста в ленте
         self.client.get(
             reverse('profile_follow', kwargs={'username': self.user3}))
+        call_command('run_jobs', '--once')
         response = self.client.get(reverse('follow_index'))
         self.assertContains(
             response, 'Тест подписок', status_code=200,
@@ -405,3 +493,1560 @@ class TestGroup(TestCase):
             msg_prefix='Группа найдена, а не должна',
             html=False
         )
+
+
+class TestCursorPagination(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="nikita", email="nikita@example.com", password="12345")
+        # 25 постов: три страницы по 10 на главной
+        for i in range(25):
+            Post.objects.create(text=f'Пост номер {i:02d}', author=self.user)
+
+    def test_cursor_walks_all_posts(self):
+        """Проверяет, что переход по курсорам вперед и назад
+        показывает все посты ровно по одному разу
+        """
+        seen = []
+        response = self.client.get(reverse('index'))
+        page = response.context['page']
+        seen += [post.id for post in page]
+        while page.has_next():
+            cache.clear()
+            response = self.client.get(
+                reverse('index'), {'cursor': page.next_cursor})
+            page = response.context['page']
+            seen += [post.id for post in page]
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        # Возвращаемся назад со второй страницы на первую
+        cache.clear()
+        response = self.client.get(reverse('index'))
+        first = [post.id for post in response.context['page']]
+        second = self.client.get(
+            reverse('index'),
+            {'cursor': response.context['page'].next_cursor}
+        ).context['page']
+        cache.clear()
+        response = self.client.get(
+            reverse('index'), {'cursor': second.previous_cursor})
+        self.assertEqual([post.id for post in response.context['page']], first)
+        self.assertFalse(response.context['page'].has_previous())
+
+    def test_legacy_page_links(self):
+        """Проверяет, что старые ссылки ?page=N продолжают работать"""
+        response = self.client.get(reverse('index'), {'page': 2})
+        self.assertContains(response, 'Пост номер 14', status_code=200)
+        self.assertNotContains(response, 'Пост номер 15')
+        cache.clear()
+        response = self.client.get(reverse('index'), {'page': 'мусор'})
+        self.assertContains(response, 'Пост номер 24', status_code=200)
+
+    def test_broken_cursor(self):
+        """Проверяет, что испорченный курсор ведет на первую страницу"""
+        response = self.client.get(reverse('index'), {'cursor': '%%%'})
+        self.assertContains(response, 'Пост номер 24', status_code=200)
+
+    def test_malformed_cursor_values(self):
+        """Проверяет, что курсор с чужими значениями не доходит до базы"""
+        for raw in (['n', 'pub_date', 'abc', 1], ['n', 'pub_date', [1], 1],
+                    ['n', 'pub_date', None, 1], ['n', 'pub_date', {}, 1],
+                    ['n', 'pub_date', '2020-01-01T00:00:00', 'x'],
+                    ['n', 'abc', 1], ['x', 'pub_date', 1, 1]):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps(raw).encode()).decode()
+            for url in (reverse('index'), '/api/v1/posts/'):
+                cache.clear()
+                response = self.client.get(url, {'cursor': cursor})
+                self.assertContains(response, 'Пост номер 24',
+                                    status_code=200)
+
+    def test_cursor_bound_to_sort_key(self):
+        """Проверяет, что курсор другой сортировки ведет на первую страницу"""
+        for i in range(15):
+            Group.objects.create(title='Группа %02d' % i, description='-')
+        page = self.client.get(
+            reverse('groups'), {'sort': 'active'}).context['page']
+        cache.clear()
+        response = self.client.get(
+            reverse('groups'), {'sort': 'title', 'cursor': page.next_cursor})
+        self.assertFalse(response.context['page'].has_previous())
+        self.assertEqual(response.context['page'][0].title, 'Группа 00')
+
+
+class TestTimeline(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.reader = User.objects.create_user(
+            username="nikita", email="nikita@example.com", password="12345")
+        self.author = User.objects.create_user(
+            username="ivan", email="ivan@example.com", password="12345")
+        Post.objects.create(text="Старый пост", author=self.author)
+
+    def test_fan_out_on_write(self):
+        """Проверяет, что лента заполняется при подписке и публикации
+        и очищается при отписке
+        """
+        self.client.login(username='nikita', password='12345')
+        self.client.get(
+            reverse('profile_follow', kwargs={'username': 'ivan'}))
+        # Лента дополняется фоновой задачей, а не в запросе подписки
+        self.assertEqual(self.reader.timeline.count(), 0)
+        call_command('run_jobs', '--once')
+        self.assertEqual(self.reader.timeline.count(), 1)
+        # Автор публикует новую запись
+        self.client.logout()
+        self.client.login(username='ivan', password='12345')
+        self.client.post(reverse('new_post'), {'text': 'Свежий пост'})
+        call_command('run_jobs', '--once')
+        self.client.logout()
+        self.client.login(username='nikita', password='12345')
+        response = self.client.get(reverse('follow_index'))
+        self.assertContains(response, 'Свежий пост', count=1)
+        self.assertContains(response, 'Старый пост', count=1)
+        # Отписываемся - лента пустеет
+        self.client.get(
+            reverse('profile_unfollow', kwargs={'username': 'ivan'}))
+        self.assertEqual(self.reader.timeline.count(), 0)
+
+    def test_fan_out_outside_views(self):
+        """Проверяет, что в ленту попадают записи, созданные не через сайт,
+        а удаленная запись из неё пропадает
+        """
+        Follow.objects.create(user=self.reader, following=self.author)
+        post = Post.objects.create(text='Из админки', author=self.author)
+        call_command('run_jobs', '--once')
+        self.assertEqual(self.reader.timeline.count(), 2)
+        post.delete()
+        self.assertEqual(
+            list(self.reader.timeline.values_list('post__text', flat=True)),
+            ['Старый пост'])
+
+    def test_rebuild_command(self):
+        """Проверяет, что команда пересобирает ленты из подписок"""
+        Follow.objects.create(user=self.reader, following=self.author)
+        self.assertEqual(TimelineEntry.objects.count(), 0)
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(
+            list(self.reader.timeline.values_list('post__text', flat=True)),
+            ['Старый пост']
+        )
+
+
+class TestCounters(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="nikita", email="nikita@example.com", password="12345")
+        self.author = User.objects.create_user(
+            username="ivan", email="ivan@example.com", password="12345")
+        self.post = Post.objects.create(text="Пост", author=self.author)
+
+    def test_counters_follow_changes(self):
+        """Проверяет, что счетчики меняются вместе с данными"""
+        Follow.objects.create(user=self.user, following=self.author)
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        stats = UserStats.objects.get(user=self.author)
+        self.assertEqual(
+            (stats.posts_count, stats.followers_count, stats.following_count),
+            (1, 1, 0)
+        )
+        self.assertEqual(UserStats.objects.get(user=self.user).following_count, 1)
+        comment.delete()
+        Follow.objects.all().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).followers_count, 0)
+
+    def test_reconcile_command(self):
+        """Проверяет, что команда исправляет расхождения счетчиков"""
+        Comment.objects.create(post=self.post, author=self.user, text='Ок')
+        Post.objects.update(comment_count=42)
+        UserStats.objects.all().delete()
+        call_command('reconcile_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.author).posts_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.user).posts_count, 0)
+
+
+class TestThumbnails(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="nikita", email="nikita@example.com", password="12345")
+        self.client.login(username='nikita', password='12345')
+        self.client.post(
+            reverse('new_post'), {'text': 'Text', 'image': make_image()})
+        self.post = Post.objects.get()
+
+    def test_thumbnails_generated_out_of_request(self):
+        """Проверяет, что до нарезки миниатюр показывается оригинал,
+        а после работы команды - миниатюра
+        """
+        self.assertFalse(self.post.thumbnails_ready)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, self.post.image.url, count=1)
+        call_command('generate_thumbnails', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertTrue(self.post.thumbnails_ready)
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, self.post.image.url)
+        self.assertContains(response, '<img', count=1)
+
+
+class TestJobs(TestCase):
+    def test_retry_with_backoff(self):
+        """Проверяет, что упавшая задача откладывается,
+        а после всех попыток помечается ошибочной
+        """
+        calls = []
+
+        def flaky(value):
+            calls.append(value)
+            raise ValueError('SMTP недоступен')
+
+        with mock.patch.dict(jobs.TASKS, {'flaky': flaky}):
+            job = jobs.enqueue('flaky', max_attempts=2, value=1)
+            self.assertEqual(jobs.run_batch(), 1)
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, 1)
+            self.assertEqual(job.status, Job.PENDING)
+            self.assertIn('SMTP недоступен', job.last_error)
+            # Задача отложена и сразу повторно не берется
+            self.assertEqual(jobs.run_batch(), 0)
+            Job.objects.update(run_at=job.created)
+            jobs.run_batch()
+            job.refresh_from_db()
+            self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(calls, [1, 1])
+
+    def test_crashed_worker_uses_attempts(self):
+        """Проверяет, что задача, с которой упал обработчик, не
+        повторяется бесконечно
+        """
+        job = jobs.enqueue('bump_cache_version', max_attempts=2,
+                           names=['feed'])
+        for attempt in (1, 2):
+            # Обработчик взял задачу и умер, не выполнив её
+            self.assertEqual(len(jobs.claim(10)), 1)
+            Job.objects.update(locked_until=timezone.now()
+                               - timezone.timedelta(seconds=1))
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+        self.assertEqual(jobs.claim(10), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_successful_job_removed(self):
+        """Проверяет, что выполненная задача удаляется из очереди"""
+        jobs.enqueue('bump_cache_version', names=['feed'])
+        self.assertEqual(jobs.run_batch(), 1)
+        self.assertFalse(Job.objects.exists())
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        # Очищаем кэш
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="nikita", email="nikita@example.com", password="12345")
+        Post.objects.create(text='Рецепт Борща со сметаной', author=self.user)
+        Post.objects.create(text='Борщ без сметаны', author=self.user)
+        Post.objects.create(text='Про котов', author=self.user)
+        Group.objects.create(title='Кулинария', description='Всё про борщ')
+
+    def test_search_posts_and_groups(self):
+        """Проверяет, что поиск находит записи и группы без учета регистра"""
+        response = self.client.get(reverse('search'), {'q': 'борщ'})
+        self.assertContains(response, 'Рецепт Борща', count=1)
+        self.assertContains(response, 'Борщ без сметаны', count=1)
+        self.assertNotContains(response, 'Про котов')
+        self.assertContains(response, 'Кулинария', count=1)
+
+    def test_all_words_required(self):
+        """Проверяет, что запись должна содержать все слова запроса"""
+        response = self.client.get(reverse('search'), {'q': 'борщ сметаной'})
+        self.assertContains(response, 'Рецепт Борща', count=1)
+        self.assertNotContains(response, 'Борщ без сметаны')
+
+    def test_search_paged_by_cursor(self):
+        """Проверяет, что ссылки на страницы сохраняют запрос"""
+        for i in range(12):
+            Post.objects.create(text=f'Борщ номер {i}', author=self.user)
+        response = self.client.get(reverse('search'), {'q': 'борщ'})
+        page = response.context['page']
+        self.assertTrue(page.has_next())
+        self.assertContains(response, '?q=%D0%B1%D0%BE%D1%80%D1%89&amp;cursor=')
+
+
+class QueryBudgetMixin:
+    """Помощники для проверки бюджетов SQL-запросов страниц"""
+
+    def count_queries(self, url_name, *args):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name, args=args))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertQueryBudget(self, url_name, *args):
+        count = self.count_queries(url_name, *args)
+        budget = settings.QUERY_BUDGETS[url_name]
+        self.assertLessEqual(
+            count, budget,
+            f'{url_name}: {count} SQL-запросов при бюджете {budget}')
+        return count
+
+
+@override_settings(QUERY_BUDGET_ACTION='raise')
+class TestQueryBudgets(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(
+            username="nikita", email="nikita@example.com", password="12345")
+        self.group = Group.objects.create(
+            title='Тест', description='desc', author=self.reader)
+        self.client.login(username='nikita', password='12345')
+        self.rounds = 0
+
+    def seed(self, count):
+        """Добавляет авторов с постами, комментариями и подписками"""
+        for i in range(count):
+            author = User.objects.create_user(
+                username=f'author{self.rounds}_{i}', password='12345')
+            post = Post.objects.create(
+                text='Пост', author=author, group=self.group)
+            Comment.objects.create(post=post, author=author, text='Раз')
+            Comment.objects.create(post=post, author=self.reader, text='Два')
+            Follow.objects.create(user=self.reader, following=author)
+            timeline.backfill(self.reader.id, author.id)
+        self.rounds += 1
+        Group.objects.create(
+            title=f'Группа {self.rounds}', description='desc')
+        return author, post
+
+    def pages(self, author, post):
+        return [
+            ('index',),
+            ('group', self.group.slug),
+            ('groups',),
+            ('profile', author.username),
+            ('post', author.username, post.id),
+            ('follow_index',),
+            ('trending',),
+            ('popular_groups',),
+            ('api_posts',),
+            ('api_group_posts', self.group.slug),
+            ('api_profile_posts', author.username),
+            ('api_follow',),
+            ('api_post', post.id),
+            ('api_post_comments', post.id),
+        ]
+
+    def test_budgets_do_not_grow_with_data(self):
+        """Проверяет, что страницы укладываются в бюджет
+        и число запросов не растет вместе с данными
+        """
+        author, post = self.seed(1)
+        small = [self.assertQueryBudget(*page)
+                 for page in self.pages(author, post)]
+        author, post = self.seed(9)
+        large = [self.assertQueryBudget(*page)
+                 for page in self.pages(author, post)]
+        self.assertEqual(small, large)
+
+    @override_settings(QUERY_BUDGETS={'index': 0})
+    def test_budget_exceeded(self):
+        """Проверяет, что превышение бюджета приводит к ошибке"""
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('index'))
+
+
+class TestBenchmark(TestCase):
+    def test_seed_and_benchmark(self):
+        """Проверяет, что генератор создает данные с перекосом,
+        а замер сохраняет результаты по всем маршрутам
+        """
+        call_command(
+            'seed_data', users=30, groups=3, posts=200, comments=100,
+            follows=200, images=0, seed=1, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 200)
+        # Самый популярный автор заметно популярнее медианного
+        counts = sorted(
+            UserStats.objects.values_list('followers_count', flat=True))
+        self.assertGreater(counts[-1], counts[len(counts) // 2] * 3)
+        # Производные данные пересчитаны
+        self.assertEqual(
+            TimelineEntry.objects.count(),
+            sum(Post.objects.filter(
+                author=follow.following).count()
+                for follow in Follow.objects.all())
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'bench.json')
+            call_command('benchmark', requests=2, warmup=0, output=output,
+                         stdout=StringIO())
+            with open(output) as f:
+                routes = json.load(f)['routes']
+        self.assertIn('index', routes)
+        self.assertIn('post', routes)
+        self.assertNotIn('post_delete', routes)
+        self.assertEqual(routes['index']['status'], 200)
+        self.assertIn('p99', routes['index'])
+
+    def test_no_samples(self):
+        """Проверяет, что замер без запросов дает пустую сводку,
+        а не ошибку
+        """
+        summary = benchmark.summarize([])
+        self.assertEqual(summary['requests'], 0)
+        self.assertIsNone(summary['p50'])
+        self.assertEqual(benchmark.compare(
+            {'routes': {'index': summary}},
+            {'routes': {'index': benchmark.summarize([0.1])}}), {'index': {}})
+        out = StringIO()
+        call_command('benchmark', requests=0, warmup=0, only=['index'],
+                     stdout=out)
+        self.assertIn('нет замеров', out.getvalue())
+
+
+class TestSeedImages(TempMediaMixin, TestCase):
+    def test_seed_images_counted(self):
+        """Проверяет, что картинки генератора лежат под именами-хэшами
+        и учтены в счетчиках ссылок
+        """
+        call_command(
+            'seed_data', users=5, groups=1, posts=30, comments=0,
+            follows=0, images=2, image_ratio=1, seed=1, stdout=StringIO())
+        names = set(Post.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 2)
+        for name in names:
+            self.assertRegex(name, r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(
+            sum(StoredFile.objects.values_list('refcount', flat=True)), 30)
+
+
+class TestProfiler(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(
+            username="admin", password="12345", is_staff=True)
+        self.user = User.objects.create_user(
+            username="nikita", password="12345")
+        for i in range(3):
+            Post.objects.create(text=f'Пост {i}', author=self.user)
+
+    @override_settings(PROFILER_MAX_REPORTS=2)
+    def test_staff_profile_report(self):
+        """Проверяет, что профилирование сотрудника сохраняет отчет
+        с разбивкой по SQL и шаблонам, а хранилище ограничено
+        """
+        self.client.login(username='admin', password='12345')
+        for _ in range(3):
+            cache.clear()
+            response = self.client.get(reverse('index'), {'_profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ProfileReport.objects.count(), 2)
+        report = ProfileReport.objects.get(pk=response['X-Profile-Report'])
+        breakdown = json.loads(report.breakdown)
+        self.assertEqual(breakdown['template:posts/post_item.html']['calls'], 3)
+        self.assertIn('view', breakdown)
+        self.assertGreater(report.sql_count, 0)
+        # Дерево: вложенные вызовы с отступом и временем
+        lines = report.call_tree.splitlines()
+        self.assertTrue(any(line.startswith('  ') for line in lines))
+        self.assertTrue(any('render' in line for line in lines))
+        # Замеры подключаются только на время профилирования
+        self.assertIsNone(Template.__dict__['render'].__dict__.get(
+            '__wrapped__'))
+
+    def test_regular_user_not_profiled(self):
+        """Проверяет, что обычный пользователь не может включить профилирование"""
+        self.client.login(username='nikita', password='12345')
+        response = self.client.get(reverse('index'), {'_profile': 'show'})
+        self.assertNotIn('X-Profile-Report', response)
+        self.assertFalse(ProfileReport.objects.exists())
+
+
+class TestCommentsPaging(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="nikita", password="12345")
+        self.post = Post.objects.create(text='Вирусный пост', author=self.user)
+        for i in range(45):
+            author = User.objects.create_user(username=f'reader{i}')
+            Comment.objects.create(
+                post=self.post, author=author, text=f'Комментарий {i:02d}')
+
+    def test_first_batch_on_post_page(self):
+        """Проверяет, что страница поста показывает только первую порцию
+        комментариев и укладывается в бюджет запросов
+        """
+        response = self.client.get(
+            reverse('post', args=['nikita', self.post.id]))
+        self.assertContains(response, 'Комментарий 19', count=1)
+        self.assertNotContains(response, 'Комментарий 20')
+        self.assertContains(response, 'js-more-comments')
+        self.assertQueryBudget('post', 'nikita', self.post.id)
+
+    def test_fragment_and_json_batches(self):
+        """Проверяет, что остальные комментарии подгружаются порциями"""
+        first = self.client.get(
+            reverse('post', args=['nikita', self.post.id])
+        ).context['comments']
+        url = reverse('post_comments', args=['nikita', self.post.id])
+        response = self.client.get(url, {'cursor': first.next_cursor})
+        self.assertContains(response, 'Комментарий 20', count=1)
+        self.assertContains(response, 'Комментарий 39', count=1)
+        self.assertNotContains(response, 'Комментарий 19')
+        data = self.client.get(url, {
+            'cursor': response.context['comments'].next_cursor,
+            'format': 'json',
+        }).json()
+        self.assertEqual(
+            [item['text'] for item in data['comments']],
+            [f'Комментарий {i}' for i in range(40, 45)]
+        )
+        self.assertIsNone(data['next_cursor'])
+
+    def test_unknown_post(self):
+        response = self.client.get(
+            reverse('post_comments', args=['nikita', self.post.id + 1]))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestPostCardCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username="nikita", password="12345")
+        self.reader = User.objects.create_user(
+            username="ivan", password="12345")
+        self.post = Post.objects.create(text='Карточка', author=self.author)
+        self.url = reverse('profile', args=['nikita'])
+
+    def test_viewer_links_not_cached(self):
+        """Проверяет, что закэшированная карточка не показывает
+        ссылки автора другим пользователям
+        """
+        self.client.login(username='nikita', password='12345')
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Редактировать', count=1)
+        self.client.login(username='ivan', password='12345')
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'Редактировать')
+
+    def test_card_for_two_viewers(self):
+        """Проверяет, что одна закэшированная карточка получает ссылки
+        только у автора
+        """
+        card = Template('{% load post_tags %}{% post_card post %}')
+        post = Post.objects.get()
+        for viewer, links in ((self.author, 1), (self.reader, 0),
+                              (AnonymousUser(), 0), (self.author, 1)):
+            html = card.render(Context({'post': post, 'user': viewer}))
+            self.assertEqual(html.count('Редактировать'), links)
+            self.assertEqual(html.count('Удалить'), links)
+            self.assertNotIn('post-actions', html)
+
+    def test_stale_instance_gets_new_version(self):
+        """Проверяет, что сохранение устаревшего экземпляра не повторяет
+        уже использованную версию
+        """
+        first = Post.objects.get()
+        second = Post.objects.get()
+        first.text = 'Первая правка'
+        first.save()
+        second.text = 'Вторая правка'
+        second.save()
+        self.assertEqual((first.version, second.version), (2, 3))
+        self.assertContains(self.client.get(self.url), 'Вторая правка')
+
+    def test_version_is_number_in_signals(self):
+        """Проверяет, что обработчики post_save видят новый номер
+        версии, а не выражение
+        """
+        seen = []
+
+        def handler(sender, instance, **kwargs):
+            seen.append(instance.version)
+
+        post_save.connect(handler, sender=Post)
+        try:
+            self.post.text = 'Правка'
+            self.post.save()
+        finally:
+            post_save.disconnect(handler, sender=Post)
+        self.assertEqual(seen, [2])
+
+    def test_group_description_keeps_cards(self):
+        """Проверяет, что карточки записей группы сбрасываются при смене
+        названия, но не при правке описания
+        """
+        group = Group.objects.create(title='Кошки', author=self.author)
+        Post.objects.filter(pk=self.post.pk).update(group=group)
+        group = Group.objects.get(pk=group.pk)
+        group.description = 'Про кошек'
+        group.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 1)
+        group.title = 'Котики'
+        group.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 2)
+
+    def test_card_follows_version(self):
+        """Проверяет, что карточка берется из кэша, пока версия записи
+        не изменилась, и обновляется после правки и комментария
+        """
+        self.client.get(self.url)
+        Post.objects.update(text='Изменено в обход версии')
+        self.assertContains(self.client.get(self.url), 'Карточка', count=1)
+        self.post.refresh_from_db()
+        self.post.text = 'Новый текст'
+        self.post.save()
+        self.assertContains(self.client.get(self.url), 'Новый текст', count=1)
+        Comment.objects.create(post=self.post, author=self.reader, text='!')
+        self.assertContains(
+            self.client.get(self.url), '1 комментариев', count=1)
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username="nikita", password="12345")
+        self.reader = User.objects.create_user(
+            username="ivan", password="12345")
+        self.post = Post.objects.create(text='Пост', author=self.author)
+
+    def revalidate(self, url, response):
+        return self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag']).status_code
+
+    def test_not_modified_until_data_changes(self):
+        """Проверяет, что повторный запрос без изменений получает 304,
+        а после нового поста или подписки - 200
+        """
+        for url in (reverse('index'), reverse('profile', args=['nikita']),
+                    reverse('post', args=['nikita', self.post.id])):
+            response = self.client.get(url)
+            self.assertIn('public', response['Cache-Control'])
+            self.assertIn('Last-Modified', response)
+            self.assertEqual(self.revalidate(url, response), 304)
+            Comment.objects.create(
+                post=self.post, author=self.reader, text='Новое')
+            self.assertEqual(self.revalidate(url, response), 200)
+        url = reverse('profile', args=['nikita'])
+        response = self.client.get(url)
+        Follow.objects.create(user=self.reader, following=self.author)
+        self.assertEqual(self.revalidate(url, response), 200)
+
+    def test_follow_feed_private(self):
+        """Проверяет, что лента подписок проверяется по версии ленты
+        пользователя и не кэшируется публично
+        """
+        self.client.login(username='ivan', password='12345')
+        url = reverse('follow_index')
+        response = self.client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.revalidate(url, response), 304)
+        self.client.get(reverse('profile_follow', args=['nikita']))
+        call_command('run_jobs', '--once')
+        self.assertEqual(self.revalidate(url, response), 200)
+
+
+class TestPageCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        middleware.PAGE_CACHE_COUNTS.clear()
+        self.author = User.objects.create_user(
+            username="nikita", password="12345")
+        self.first = Group.objects.create(title='Первая', author=self.author)
+        self.second = Group.objects.create(title='Вторая', author=self.author)
+        self.post = Post.objects.create(
+            text='Пост', author=self.author, group=self.first)
+        self.other = Post.objects.create(
+            text='Другой', author=self.author, group=self.second)
+
+    def page_cache(self, url):
+        return self.client.get(url)['X-Page-Cache']
+
+    def test_anonymous_pages_cached(self):
+        """Проверяет, что анонимам страницы отдаются из кэша,
+        а авторизованным - нет
+        """
+        for url in (reverse('index'), reverse('group', args=['pervaya']),
+                    reverse('profile', args=['nikita']),
+                    reverse('post', args=['nikita', self.post.id])):
+            self.assertEqual(self.page_cache(url), 'miss')
+            response = self.client.get(url)
+            self.assertEqual(response['X-Page-Cache'], 'hit')
+            self.assertContains(response, 'Пост')
+        self.client.login(username='nikita', password='12345')
+        self.assertNotIn('X-Page-Cache', self.client.get(reverse('index')))
+
+    def test_selective_invalidation(self):
+        """Проверяет, что изменение записи сбрасывает только страницы,
+        на которых она показана
+        """
+        first = reverse('group', args=['pervaya'])
+        second = reverse('group', args=['vtoraya'])
+        self.client.get(first)
+        self.client.get(second)
+        self.other.text = 'Изменено'
+        self.other.save()
+        self.assertEqual(self.page_cache(first), 'hit')
+        self.assertEqual(self.page_cache(second), 'miss')
+        self.other.group = self.first
+        self.other.save()
+        self.assertEqual(self.page_cache(first), 'miss')
+        self.assertEqual(self.page_cache(second), 'miss')
+        self.assertEqual(self.page_cache(second), 'hit')
+        self.assertEqual(self.page_cache(first), 'hit')
+        Comment.objects.create(post=self.post, author=self.author, text='Ок')
+        self.assertEqual(self.page_cache(first), 'miss')
+        self.assertEqual(self.page_cache(second), 'hit')
+
+    def test_conditional_get_on_hit(self):
+        """Проверяет, что ответ из кэша тоже отвечает 304 по ETag"""
+        url = reverse('index')
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+
+    def test_stats_command(self):
+        """Проверяет вывод статистики попаданий"""
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        out = StringIO()
+        call_command('page_cache_stats', stdout=out)
+        self.assertIn('50.0%', out.getvalue())
+
+    def test_stats_not_written_on_hit(self):
+        """Проверяет, что счетчики копятся в воркере и пишутся
+        в общий кэш не на каждом запросе
+        """
+        self.client.get(reverse('index'))
+        middleware.flush_counts()
+        with mock.patch.object(middleware.cache, 'incr') as incr:
+            self.client.get(reverse('index'))
+            self.client.get(reverse('index'))
+        incr.assert_not_called()
+        self.assertEqual(
+            middleware.page_cache_stats()['index'],
+            {'hits': 2, 'misses': 1})
+
+
+class TestConnections(TestCase):
+    def check(self, idle, usable=True, use=True):
+        """Запускает проверку соединения, простоявшего idle секунд,
+        и обращается к базе, если use
+        """
+        connection.ensure_connection()
+        connection.released_at = time.monotonic() - idle
+        settings_dict = {'CONN_IDLE_TIMEOUT': 30, 'CONN_HEALTH_CHECKS': True}
+        with mock.patch.object(connection, 'in_atomic_block', False), \
+                mock.patch.dict(connection.settings_dict, settings_dict), \
+                mock.patch.object(connection, 'is_usable',
+                                  return_value=usable) as is_usable, \
+                mock.patch.object(connection, 'close') as close:
+            connections.check_connections(sender=None)
+            if use:
+                connection.ensure_connection()
+        return close.called, is_usable.called
+
+    def test_reused(self):
+        """Проверяет, что живое соединение переиспользуется"""
+        self.assertEqual(self.check(idle=1), (False, True))
+
+    def test_idle_closed(self):
+        """Проверяет, что долго простоявшее соединение закрывается"""
+        self.assertTrue(self.check(idle=60)[0])
+
+    def test_broken_closed(self):
+        """Проверяет, что оборванное соединение закрывается до запроса"""
+        with self.assertLogs('posts.connections', 'WARNING') as logs:
+            self.assertEqual(self.check(idle=1, usable=False), (True, True))
+        self.assertIn('оборвано', logs.output[0])
+
+    def test_checked_only_when_used(self):
+        """Проверяет, что запрос без обращений к базе не проверяет
+        соединение
+        """
+        self.assertEqual(self.check(idle=1, use=False), (False, False))
+
+
+class TestApi(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username="nikita", password="12345")
+        self.reader = User.objects.create_user(
+            username="ivan", password="12345")
+        self.group = Group.objects.create(title='Тест', author=self.author)
+        self.posts = [
+            Post.objects.create(
+                text=f'Пост {i}', author=self.author, group=self.group)
+            for i in range(12)
+        ]
+        Comment.objects.create(
+            post=self.posts[0], author=self.reader, text='Коммент')
+
+    def get(self, url_name, *args, **params):
+        response = self.client.get(reverse(url_name, args=args), params)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return response
+
+    def test_feeds(self):
+        """Проверяет ленты, курсоры и набор полей записи"""
+        data = self.get('api_posts').json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(set(data['results'][0]), {
+            'id', 'text', 'pub_date', 'author', 'group', 'image',
+            'comment_count'})
+        self.assertEqual(data['results'][0]['text'], 'Пост 11')
+        data = self.get('api_posts', cursor=data['next']).json()
+        self.assertEqual([post['text'] for post in data['results']],
+                         ['Пост 1', 'Пост 0'])
+        self.assertIsNone(data['next'])
+        data = self.get('api_group_posts', self.group.slug).json()
+        self.assertEqual(data['results'][0]['group'], self.group.slug)
+        data = self.get('api_profile_posts', 'nikita').json()
+        self.assertEqual(len(data['results']), 5)
+        data = self.get('api_post_comments', self.posts[0].id).json()
+        self.assertEqual(data['results'][0]['text'], 'Коммент')
+        data = self.get('api_post', self.posts[0].id).json()
+        self.assertEqual(data['comment_count'], 1)
+
+    def test_errors(self):
+        """Проверяет ответы JSON на ошибки"""
+        self.assertEqual(self.get('api_post', 999).status_code, 404)
+        self.assertEqual(self.get('api_follow').status_code, 401)
+        response = self.client.post(reverse('api_posts'))
+        self.assertEqual(response.status_code, 405)
+
+    def test_follow_feed(self):
+        """Проверяет ленту подписок авторизованного пользователя"""
+        self.client.login(username='ivan', password='12345')
+        self.client.get(reverse('profile_follow', args=['nikita']))
+        call_command('run_jobs', '--once')
+        data = self.get('api_follow').json()
+        self.assertEqual(len(data['results']), 10)
+
+    def test_etag(self):
+        """Проверяет, что без изменений данных ответ 304"""
+        url = reverse('api_posts')
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        Post.objects.create(text='Новый', author=self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+class TestExport(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username="nikita", password="12345")
+        self.reader = User.objects.create_user(
+            username="ivan", password="12345")
+        self.group = Group.objects.create(title='Тест', author=self.author)
+        for i in range(3):
+            post = Post.objects.create(
+                text=f'Пост {i}', author=self.author, group=self.group)
+            Comment.objects.create(post=post, author=self.reader, text='Ок')
+        self.client.login(username='nikita', password='12345')
+
+    def export(self, url_name, arg, **params):
+        response = self.client.get(reverse(url_name, args=[arg]), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_ndjson(self):
+        """Проверяет выгрузку записей и комментариев построчно"""
+        lines = self.export('export_profile', 'nikita').decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['type'] for row in rows], ['post'] * 3
+                         + ['comment'] * 3)
+        self.assertEqual(rows[0]['text'], 'Пост 0')
+        self.assertEqual(rows[0]['group'], self.group.slug)
+
+    def test_csv_gzip(self):
+        """Проверяет CSV, сжатый на лету"""
+        content = self.export('export_group', self.group.slug,
+                              format='csv', gzip='1', comments='0')
+        lines = gzip.decompress(content).decode().splitlines()
+        self.assertTrue(lines[0].startswith('type,id,post_id'))
+        self.assertEqual(len(lines), 4)
+
+    def test_only_owner_or_staff(self):
+        """Проверяет, что чужие записи выгрузить нельзя"""
+        self.client.login(username='ivan', password='12345')
+        response = self.client.get(reverse('export_profile', args=['nikita']))
+        self.assertRedirects(response, reverse('profile', args=['nikita']))
+
+    def test_command(self):
+        """Проверяет выгрузку командой в файл"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'posts.ndjson.gz')
+            call_command('export_posts', '--user', 'nikita', '--gzip',
+                         '--output', path)
+            with gzip.open(path, 'rt') as f:
+                self.assertEqual(len(f.readlines()), 6)
+
+
+class TestImport(TestCase):
+    rows = [
+        {'type': 'group', 'id': 1, 'title': 'Кошки', 'author': 'masha'},
+        {'type': 'group', 'id': 2, 'title': 'Кошки'},
+        {'type': 'post', 'id': 10, 'author': 'masha', 'group': 1,
+         'text': 'Первый', 'created': '2019-05-01T10:00:00+00:00'},
+        {'type': 'post', 'id': 11, 'author': 'petya', 'group': 2,
+         'text': 'Второй'},
+        {'type': 'comment', 'id': 20, 'post_id': 10, 'author': 'petya',
+         'text': 'Ок'},
+        {'type': 'comment', 'id': 21, 'post_id': 999, 'author': 'petya',
+         'text': 'Без записи'},
+        {'type': 'follow', 'user': 'petya', 'following': 'masha'},
+        {'type': 'follow', 'user': 'petya', 'following': 'masha'},
+        {'type': 'follow', 'user': 'masha', 'following': 'masha'},
+    ]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'dump.ndjson')
+        with open(self.path, 'w') as f:
+            for row in self.rows:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def load(self, *args):
+        call_command('import_data', self.path, '--batch-size', '3', *args,
+                     stdout=StringIO())
+
+    def test_import(self):
+        """Проверяет загрузку, уникальные slug и пересчет счетчиков"""
+        self.load()
+        self.assertEqual(
+            sorted(Group.objects.values_list('slug', flat=True)),
+            ['koshki', 'koshki-2'])
+        first = Post.objects.get(text='Первый')
+        self.assertEqual(first.group.slug, 'koshki')
+        self.assertEqual(first.pub_date.year, 2019)
+        self.assertEqual(first.comment_count, 1)
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(Follow.objects.count(), 1)
+        petya = User.objects.get(username='petya')
+        self.assertEqual(TimelineEntry.objects.filter(user=petya).count(), 1)
+        self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+
+    def test_repeat_and_resume(self):
+        """Проверяет, что повторная загрузка не создает дублей,
+        а checkpoint пропускает загруженные строки
+        """
+        self.load()
+        self.load()
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(Group.objects.count(), 2)
+        with open(self.path + '.checkpoint', 'w') as f:
+            json.dump({'rows': 3}, f)
+        self.load('--source', 'другой')
+        self.assertEqual(Group.objects.count(), 2)
+        self.assertEqual(Post.objects.count(), 3)
+
+    def test_counts(self):
+        """Проверяет, что отброшенные строки считаются пропущенными,
+        а уже существующие подписки - не новыми
+        """
+        loader = importer.Importer('test')
+        loader.load(self.rows + [{'type': 'group', 'id': 3},
+                                 {'type': 'post', 'id': 12, 'text': 'Ничей'}])
+        loader.finish()
+        self.assertEqual(loader.counts['group'], 2)
+        self.assertEqual(loader.counts['post'], 2)
+        self.assertEqual(loader.counts['comment'], 1)
+        self.assertEqual(loader.counts['follow'], 1)
+        self.assertEqual(loader.counts['user'], 2)
+        # группа без названия, запись без автора, комментарий без записи,
+        # повтор подписки и подписка на себя
+        self.assertEqual(loader.counts['skipped'], 5)
+        loader = importer.Importer('другой')
+        loader.load([{'type': 'follow', 'user': 'petya',
+                      'following': 'masha'}])
+        self.assertEqual(loader.counts['follow'], 0)
+        self.assertEqual(loader.counts['skipped'], 1)
+        self.assertEqual(loader.counts['user'], 0)
+
+    def test_finish_touches_imported_only(self):
+        """Проверяет, что после импорта пересчитываются только
+        затронутые им пользователи и ленты
+        """
+        other = User.objects.create_user(username='other')
+        author = User.objects.create_user(username='author')
+        masha = User.objects.create_user(username='masha')
+        Post.objects.create(text='Старая', author=author)
+        Follow.objects.create(user=other, following=author)
+        Follow.objects.create(user=other, following=masha)
+        UserStats.objects.filter(user=other).update(following_count=7)
+        TimelineEntry.objects.filter(user=other).delete()
+        self.load()
+        self.assertEqual(
+            UserStats.objects.get(user=other).following_count, 7)
+        # Ленты не пересобираются: новая запись разложена подписчику,
+        # удаленная строка чужого автора не вернулась
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(user=other).values_list(
+                'post__text', flat=True)), ['Первый'])
+        petya = User.objects.get(username='petya')
+        self.assertEqual(UserStats.objects.get(user=petya).following_count, 1)
+        self.assertEqual(UserStats.objects.get(user=masha).posts_count, 1)
+
+    def test_copy_rows_null(self):
+        """Проверяет, что в CSV для COPY None - пустое поле без кавычек,
+        а пустая строка остается строкой в кавычках
+        """
+        author = User.objects.create_user(username='masha')
+        fields = [Post._meta.get_field(name)
+                  for name in ('text', 'author', 'group')]
+        data = importer.copy_rows(fields, [
+            Post(text='', author=author),
+            Post(text='Да "нет"', author=author, group_id=5),
+        ])
+        self.assertEqual(data, '"","%d",\n"Да ""нет""","%d","5"\n' % (
+            author.id, author.id))
+        rows = list(csv.reader(io.StringIO(data)))
+        self.assertEqual(rows[1][0], 'Да "нет"')
+
+    def test_export_round_trip(self):
+        """Проверяет, что выгрузка export_posts загружается обратно"""
+        self.load()
+        path = os.path.join(self.tmp.name, 'masha.csv.gz')
+        call_command('export_posts', '--user', 'masha', '--format', 'csv',
+                     '--gzip', '--output', path)
+        call_command('import_data', path, stdout=StringIO())
+        self.assertEqual(Post.objects.filter(text='Первый').count(), 2)
+        self.assertEqual(Comment.objects.count(), 2)
+
+
+@override_settings(REPLICA_DATABASES=['replica1', 'replica2'])
+class TestReplicaRouting(TestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        routers.unpin()
+
+    def tearDown(self):
+        routers.unpin()
+
+    def pinned_during(self, request):
+        """Возвращает, было ли чтение закреплено во время запроса"""
+        seen = []
+
+        def view(request):
+            seen.append(routers.is_pinned())
+            return HttpResponse()
+
+        response = routers.PrimaryPinMiddleware(view)(request)
+        return seen[0], response
+
+    def test_reads_go_to_replicas(self):
+        """Проверяет, что чтение записей идет с реплик,
+        а сессии и запись - с основной базы
+        """
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertIn(self.router.db_for_read(Post),
+                          ('replica1', 'replica2'))
+            self.assertEqual(self.router.db_for_read(Session), 'default')
+            self.assertEqual(self.router.db_for_write(Post), 'default')
+            self.assertFalse(routers.is_pinned())
+
+    def test_read_your_writes(self):
+        """Проверяет, что после записи чтение закреплено за основной базой
+        на время запроса и, через куку, на несколько секунд после
+        """
+        factory = RequestFactory()
+
+        def write(request):
+            Post.objects.filter(pk=0).update(text='')
+            return HttpResponse()
+
+        response = routers.PrimaryPinMiddleware(write)(factory.get('/'))
+        cookie = response.cookies['primary_pin']
+        self.assertFalse(routers.is_pinned())
+        pinned, _ = self.pinned_during(factory.get('/'))
+        self.assertFalse(pinned)
+        request = factory.get('/')
+        request.COOKIES['primary_pin'] = cookie.value
+        pinned, response = self.pinned_during(request)
+        self.assertTrue(pinned)
+        self.assertNotIn('primary_pin', response.cookies)
+        pinned, _ = self.pinned_during(factory.post('/'))
+        self.assertTrue(pinned)
+
+    def test_get_or_create_does_not_pin(self):
+        """Проверяет, что get_or_create без вставки не закрепляет
+        чтение за основной базой, а вставка закрепляет
+        """
+        user = User.objects.create_user(username='nikita')
+        UserStats.objects.filter(user=user).delete()
+
+        def view(request):
+            UserStats.objects.get_or_create(user=user)
+            return HttpResponse()
+
+        response = routers.PrimaryPinMiddleware(view)(
+            RequestFactory().get('/'))
+        self.assertIn('primary_pin', response.cookies)
+        response = routers.PrimaryPinMiddleware(view)(
+            RequestFactory().get('/'))
+        self.assertNotIn('primary_pin', response.cookies)
+
+    def test_fresh_version_reads_primary(self):
+        """Проверяет, что страницу со свежей версией кэша собирают
+        с основной базы, а не с отстающей реплики
+        """
+        with mock.patch('posts.routers.time.time',
+                        return_value=time.time() - 60):
+            bump_version(FEED)
+        get_version(FEED)
+        self.assertFalse(routers.is_pinned())
+        bump_version(FEED)
+        get_versions(FEED)
+        self.assertTrue(routers.is_pinned())
+
+
+@skipUnless(settings.REPLICA_DATABASES, 'Нужна реплика: DB_REPLICA_HOSTS')
+class TestReplicaDatabases(TransactionTestCase):
+    databases = {'default', *settings.REPLICA_DATABASES}
+
+    def test_pages_read_from_replica(self):
+        """Проверяет страницу на двух настоящих соединениях: данные
+        закоммичены в основную базу и прочитаны через реплику
+        """
+        cache.clear()
+        author = User.objects.create_user(username='nikita', password='1')
+        Post.objects.create(text='С реплики', author=author)
+        routers.unpin()
+        replica = settings.REPLICA_DATABASES[0]
+        with CaptureQueriesContext(db_connections[replica]) as queries:
+            response = self.client.get(reverse('profile', args=['nikita']))
+        self.assertContains(response, 'С реплики')
+        self.assertTrue(queries)
+
+
+class TestTrending(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username="nikita", password="12345")
+        self.reader = User.objects.create_user(
+            username="ivan", password="12345")
+        self.quiet = Group.objects.create(title='Тихая', author=self.author)
+        self.busy = Group.objects.create(title='Шумная', author=self.author)
+        self.old = Post.objects.create(
+            text='Старый', author=self.author, group=self.quiet)
+        self.hot = Post.objects.create(
+            text='Горячий', author=self.author, group=self.busy)
+
+    def update(self):
+        """Пересчет рейтинга, когда свежие строки уже зафиксированы"""
+        trending.update(now=timezone.now() + trending.COMMIT_LAG)
+
+    def comment(self, post, count):
+        for _ in range(count):
+            Comment.objects.create(post=post, author=self.reader, text='!')
+
+    def test_ranking(self):
+        """Проверяет, что рейтинг строится по новой активности
+        и дополняется без пересчета старых строк
+        """
+        self.comment(self.hot, 3)
+        self.update()
+        self.assertEqual(trending.top_ids(trending.POST),
+                         [self.hot.id, self.old.id])
+        self.assertEqual(trending.top_ids(trending.GROUP),
+                         [self.busy.id, self.quiet.id])
+        self.comment(self.old, 5)
+        self.update()
+        self.assertEqual(
+            Watermark.objects.get(name='trending_comments').value,
+            Comment.objects.latest('id').id)
+        self.assertEqual(trending.top_ids(trending.POST)[0], self.old.id)
+        self.assertEqual(
+            sum(ActivityBucket.objects.filter(
+                kind='post').values_list('comments', flat=True)), 8)
+
+    def test_window(self):
+        """Проверяет, что активность за пределами окна выпадает"""
+        self.comment(self.hot, 2)
+        self.update()
+        later = timezone.now() + trending.WINDOW + timezone.timedelta(hours=2)
+        trending.update(now=later)
+        self.assertEqual(trending.top_ids(trending.POST), [])
+        self.assertFalse(ActivityBucket.objects.exists())
+
+    def test_young_rows_wait(self):
+        """Проверяет, что водяной знак не проходит строки моложе
+        COMMIT_LAG: их id могли выдать раньше, чем зафиксировали
+        соседние строки
+        """
+        self.comment(self.hot, 1)
+        trending.update()
+        mark = Watermark.objects.get(name='trending_comments').value
+        self.assertEqual(mark, 0)
+        # Старая дата у строки с большим id не сдвигает знак дальше
+        # молодой строки
+        self.comment(self.old, 1)
+        Comment.objects.filter(id=Comment.objects.latest('id').id).update(
+            created=timezone.now() - timezone.timedelta(hours=1))
+        trending.update()
+        self.assertEqual(
+            Watermark.objects.get(name='trending_comments').value, mark)
+        self.update()
+        self.assertEqual(
+            sum(ActivityBucket.objects.filter(
+                kind='post').values_list('comments', flat=True)), 2)
+
+    def test_pages(self):
+        """Проверяет страницы популярного"""
+        self.comment(self.hot, 1)
+        self.update()
+        response = self.client.get(reverse('trending'))
+        self.assertEqual(
+            [post.id for post in response.context['posts']],
+            [self.hot.id, self.old.id])
+        response = self.client.get(reverse('popular_groups'))
+        self.assertContains(response, 'Шумная')
+
+
+class TestGroupStats(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username="nikita", password="12345")
+        self.first = Group.objects.create(title='Альфа', author=self.author)
+        self.second = Group.objects.create(title='Бета', author=self.author)
+
+    def stats(self, group):
+        group.refresh_from_db()
+        return group.posts_count, group.last_activity
+
+    def test_counts_follow_posts(self):
+        """Проверяет счетчик и дату последней записи при создании,
+        переносе и удалении записей
+        """
+        old = Post.objects.create(
+            text='Раз', author=self.author, group=self.first)
+        new = Post.objects.create(
+            text='Два', author=self.author, group=self.first)
+        self.assertEqual(self.stats(self.first), (2, new.pub_date))
+        new.group = self.second
+        new.save()
+        self.assertEqual(self.stats(self.first), (1, old.pub_date))
+        self.assertEqual(self.stats(self.second), (1, new.pub_date))
+        new.delete()
+        self.assertEqual(self.stats(self.second)[0], 0)
+        Group.objects.update(posts_count=0)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(self.stats(self.first), (1, old.pub_date))
+
+    def test_empty_group_sorts_last(self):
+        """Проверяет, что новая группа без записей не обгоняет
+        по активности группы с записями, а группа, потерявшая все
+        записи, уходит в конец
+        """
+        post = Post.objects.create(
+            text='Пост', author=self.author, group=self.first)
+        Post.objects.filter(pk=post.pk).update(
+            pub_date=timezone.now() - timezone.timedelta(days=30))
+        call_command('reconcile_counters', stdout=StringIO())
+        Group.objects.create(title='Новая', author=self.author)
+        response = self.client.get(reverse('groups'), {'sort': 'active'})
+        self.assertEqual(response.context['page'][0], self.first)
+        post.delete()
+        self.assertEqual(self.stats(self.first), (0, NO_ACTIVITY))
+
+    def test_sort_and_paging(self):
+        """Проверяет сортировку по активности и курсоры списка групп"""
+        for i in range(11):
+            Group.objects.create(title=f'Группа {i:02}')
+        Post.objects.create(text='Пост', author=self.author, group=self.first)
+        response = self.client.get(reverse('groups'), {'sort': 'active'})
+        self.assertEqual(response.context['page'][0], self.first)
+        response = self.client.get(reverse('groups'))
+        page = response.context['page']
+        self.assertEqual(page[0], self.first)
+        self.assertTrue(page.has_next())
+        response = self.client.get(
+            reverse('groups'), {'cursor': page.next_cursor})
+        titles = [group.title for group in response.context['page']]
+        self.assertEqual(titles, ['Группа 08', 'Группа 09', 'Группа 10'])
+
+
+class TestSlugs(TestCase):
+    def test_same_title(self):
+        """Проверяет, что одинаковые названия получают разные slug,
+        а не ошибку уникальности
+        """
+        slugs = [Group.objects.create(title='Кошки').slug for _ in range(3)]
+        self.assertEqual(slugs, ['koshki', 'koshki-2', 'koshki-3'])
+
+    def test_recompute_only_on_title_change(self):
+        """Проверяет, что slug пересчитывается только при смене названия"""
+        group = Group.objects.create(title='Кошки', slug='cats')
+        self.assertEqual(group.slug, 'cats')
+        group = Group.objects.get(pk=group.pk)
+        group.description = 'Новое описание'
+        with CaptureQueriesContext(connection) as queries:
+            group.save()
+        self.assertEqual(group.slug, 'cats')
+        self.assertFalse(any('LIKE' in query['sql']
+                             for query in queries.captured_queries))
+        group.title = 'Собаки'
+        group.save()
+        self.assertEqual(group.slug, 'sobaki')
+
+    def test_same_as_legacy(self):
+        """Проверяет, что быстрая транслитерация дает прежний результат"""
+        from .management.commands.benchmark_slugs import TITLES, legacy_slugify
+        for title in TITLES + ['', '  Ёж и  ЁЛКА!! ', 'Café №5']:
+            self.assertEqual(my_slugify(title), legacy_slugify(title))
+
+    def test_backfill(self):
+        """Проверяет пакетное проставление slug после импорта"""
+        Group.objects.create(title='Кошки')
+        Group.objects.bulk_create([Group(title='Кошки', slug='tmp-1'),
+                                   Group(title='Ёжики', slug='')])
+        group = Group.objects.get(slug='tmp-1')
+        author = User.objects.create_user(username='nikita')
+        post = Post.objects.create(text='Мяу', author=author, group=group)
+        versions = get_versions(FEED, group_tag(group.pk))
+        time.sleep(0.01)
+        call_command('backfill_slugs', stdout=StringIO())
+        self.assertEqual(
+            sorted(Group.objects.values_list('slug', flat=True)),
+            ['koshki', 'koshki-2', 'yozhiki'])
+        # Карточки и страницы со старой ссылкой на группу устарели
+        post_version = post.version
+        post.refresh_from_db()
+        self.assertEqual(post.version, post_version + 1)
+        new_versions = get_versions(FEED, group_tag(group.pk))
+        self.assertTrue(all(new > old for new, old in zip(
+            new_versions, versions)))
+
+
+class TestImageNormalization(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="nikita", password="12345")
+        self.client.login(username='nikita', password='12345')
+
+    def upload(self, width, height):
+        """Загружает JPEG с EXIF-поворотом на 90 градусов"""
+        image = Image.new('RGB', (width, height), (200, 30, 30))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        self.client.post(reverse('new_post'), {
+            'text': 'Фото',
+            'image': SimpleUploadedFile('photo.JPG', buffer.getvalue(),
+                                        'image/jpeg'),
+        })
+        return Post.objects.get()
+
+    def test_original_normalized(self):
+        """Проверяет, что оригинал повернут, уменьшен и без EXIF"""
+        post = self.upload(4000, 3000)
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.size, (1536, 2048))
+            self.assertFalse(stored.getexif())
+        self.assertTrue(post.image.name.endswith('.jpg'))
+
+    def test_responsive_variants(self):
+        """Проверяет, что карточка предлагает WebP и JPEG разной ширины"""
+        self.upload(1200, 800)
+        call_command('generate_thumbnails', stdout=StringIO())
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, '.webp 480w')
+        self.assertContains(response, '.jpg 960w')
+
+
+class TestContentAddressedStorage(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="nikita", password="12345")
+        self.client.login(username='nikita', password='12345')
+        # В TestCase транзакция не фиксируется, удаление файла
+        # выполняем сразу
+        self.on_commit = mock.patch.object(
+            storage.transaction, 'on_commit', lambda func: func())
+        self.on_commit.start()
+
+    def tearDown(self):
+        self.on_commit.stop()
+        super().tearDown()
+
+    def upload(self, name='meme.png', color=(10, 20, 30)):
+        buffer = io.BytesIO()
+        Image.new('RGB', (60, 40), color).save(buffer, 'PNG')
+        self.client.post(reverse('new_post'), {
+            'text': 'Мем',
+            'image': SimpleUploadedFile(name, buffer.getvalue(), 'image/png'),
+        })
+        return Post.objects.latest('id')
+
+    def test_concurrent_same_content(self):
+        """Проверяет, что сохранение уже записанного кем-то файла
+        возвращает его имя, а не повторяет запись без конца
+        """
+        content = ContentFile(b'one content')
+        name = storage.post_images.save('posts/a.txt', content)
+        with mock.patch.object(storage.post_images, 'exists',
+                               return_value=False):
+            again = storage.post_images.save('posts/b.txt', content)
+        self.assertEqual(again, name)
+        self.assertEqual(
+            os.listdir(os.path.dirname(storage.post_images.path(name))),
+            [os.path.basename(name)])
+
+    def test_same_upload_shares_file(self):
+        """Проверяет, что одинаковые картинки хранятся одним файлом"""
+        first = self.upload('first.png')
+        second = self.upload('second.png')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.')
+        self.assertEqual(StoredFile.objects.get().refcount, 2)
+        files = [name for _, _, names in os.walk(self.media.name)
+                 for name in names]
+        self.assertEqual(len(files), 1)
+
+    def test_shared_thumbnails_reused(self):
+        """Проверяет, что для копии картинки миниатюры не нарезаются снова"""
+        self.upload()
+        call_command('run_jobs', '--once')
+        second = self.upload()
+        self.assertTrue(second.thumbnails_ready)
+        self.assertFalse(Job.objects.filter(name='generate_thumbnails',
+                                            status=Job.PENDING).exists())
+
+    def test_file_removed_with_last_reference(self):
+        """Проверяет, что файл удаляется вместе с последней ссылкой"""
+        first = self.upload()
+        second = self.upload()
+        path = first.image.path
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_replaced_image_released(self):
+        """Проверяет, что замена картинки снимает ссылку со старой"""
+        post = self.upload()
+        old_path = post.image.path
+        buffer = io.BytesIO()
+        Image.new('RGB', (60, 40), (200, 0, 0)).save(buffer, 'PNG')
+        self.client.post(
+            reverse('post_edit', args=[self.user.username, post.id]),
+            {'text': 'Другой мем', 'image': SimpleUploadedFile(
+                'other.png', buffer.getvalue(), 'image/png')})
+        post.refresh_from_db()
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(post.image.path))
+        self.assertEqual(
+            list(StoredFile.objects.values_list('name', 'refcount')),
+            [(post.image.name, 1)])
+
+    def test_dedupe_legacy_images(self):
+        """Проверяет перенос старых файлов под имена-хэши"""
+        post = self.upload()
+        content = post.image.read()
+        post.image.close()
+        ext = os.path.splitext(post.image.name)[1]
+        for name in ('posts/old' + ext, 'posts/old_copy' + ext):
+            path = os.path.join(self.media.name, name)
+            with open(path, 'wb') as f:
+                f.write(content)
+            Post.objects.create(text='Старый', author=self.user)
+            Post.objects.filter(pk=Post.objects.latest('id').pk).update(
+                image=name)
+        call_command('dedupe_images', stdout=StringIO())
+        self.assertEqual(
+            set(Post.objects.values_list('image', flat=True)),
+            {post.image.name})
+        self.assertEqual(StoredFile.objects.get().refcount, 3)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.media.name, 'posts/old' + ext)))
+
+
+class TestWindowedPaginator(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser(
+            username="admin", email='admin@example.com', password="12345")
+        Post.objects.bulk_create(
+            [Post(text='Запись %d' % i, author=self.user) for i in range(45)])
+
+    def paginator(self, queryset=None, **kwargs):
+        return pagination.WindowedPaginator(
+            queryset or Post.objects.order_by('id'), 2, **kwargs)
+
+    def test_estimated_count(self):
+        """Проверяет, что большая таблица не считается через COUNT(*)"""
+        paginator = self.paginator()
+        with mock.patch.object(pagination, 'estimated_count',
+                               return_value=40000):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(paginator.count, 40000)
+        self.assertEqual(len(queries), 0)
+        self.assertTrue(paginator.estimated)
+        # Оценка больше настоящего числа строк, но на последней
+        # настоящей странице ссылки дальше нет
+        self.assertFalse(paginator.page(23).has_next())
+
+    def test_estimate_below_real_count(self):
+        """Проверяет, что страницы за оценкой всё равно открываются"""
+        paginator = self.paginator(exact_count_limit=10)
+        with mock.patch.object(pagination, 'estimated_count',
+                               return_value=20):
+            page = paginator.page(15)
+        self.assertEqual(len(page), 2)
+        self.assertTrue(page.has_next())
+
+    def test_filtered_count_cached(self):
+        """Проверяет, что точный COUNT(*) выборки запоминается в кэше"""
+        queryset = Post.objects.filter(text__startswith='Запись 1')
+        self.assertEqual(self.paginator(queryset).count, 11)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.paginator(queryset).count, 11)
+        self.assertEqual(len(queries), 0)
+
+    def test_admin_uses_windowed_paginator(self):
+        """Проверяет, что список записей в админке открывается"""
+        self.client.login(username='admin', password='12345')
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'p': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.context['cl'].paginator,
+                              pagination.WindowedPaginator)
@@ -0,0 +1,63 @@
+from django.db.models import F
+from sorl.thumbnail import get_thumbnail
+
+from .cache import FEED, bump_version, post_tag
+from .models import Post
+
+
+# Миниатюры, которые используют шаблоны: (геометрия, параметры).
+# Карточка предлагает браузеру две ширины в WebP и JPEG через srcset,
+# параметры должны совпадать с тегами thumbnail в post_card.html
+CARD = {'crop': 'center', 'upscale': True}
+WEBP = dict(CARD, format='WEBP', quality=80)
+GEOMETRIES = (
+    ('960x339', CARD),
+    ('480x170', CARD),
+    ('960x339', WEBP),
+    ('480x170', WEBP),
+)
+
+
+def generate(post):
+    """
+    Нарезает все миниатюры картинки записи и помечает их готовыми.
+    """
+    if post.image:
+        for geometry, options in GEOMETRIES:
+            get_thumbnail(post.image, geometry, **options)
+    Post.objects.filter(pk=post.pk).update(
+        thumbnails_ready=True, version=F('version') + 1)
+    bump_version(post_tag(post.pk))
+
+
+def reuse(post):
+    """
+    Одинаковые картинки хранятся одним файлом с общими миниатюрами:
+    если они уже нарезаны для другой записи, запись сразу помечается
+    готовой и задача в очередь не ставится.
+    """
+    ready = Post.objects.filter(
+        image=post.image.name, thumbnails_ready=True).exclude(pk=post.pk)
+    if not post.image or not ready.exists():
+        return False
+    Post.objects.filter(pk=post.pk).update(
+        thumbnails_ready=True, version=F('version') + 1)
+    bump_version(post_tag(post.pk))
+    return True
+
+
+def pending():
+    return Post.objects.exclude(image='').filter(thumbnails_ready=False)
+
+
+def process(queryset, batch_size=100):
+    """
+    Нарезает миниатюры для записей queryset, возвращает их количество.
+    """
+    done = 0
+    for post in queryset.only('id', 'image').iterator(chunk_size=batch_size):
+        generate(post)
+        done += 1
+    if done:
+        bump_version(FEED)
+    return done
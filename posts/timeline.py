@@ -0,0 +1,99 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from .cache import FEED, bump_version, timeline_version
+from .models import Follow, Post, TimelineEntry
+from .utils import chunks
+
+
+# Сколько строк ленты вставлять за один запрос
+BATCH_SIZE = 1000
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def fan_out(post):
+    """
+    Раскладывает новую запись по лентам всех подписчиков автора.
+    """
+    followers = Follow.objects.filter(
+        following=post.author_id
+    ).values_list('user_id', flat=True)
+    batch = []
+    for user_id in followers.iterator(chunk_size=BATCH_SIZE):
+        batch.append(TimelineEntry(
+            user_id=user_id, post_id=post.id,
+            author_id=post.author_id, pub_date=post.pub_date,
+        ))
+        if len(batch) >= BATCH_SIZE:
+            _bulk_insert(batch)
+            batch = []
+    _bulk_insert(batch)
+
+
+def fan_out_posts(post_ids):
+    """
+    Раскладывает пачку записей (например, загруженных импортом) по лентам
+    подписчиков: подписчики каждого автора читаются один раз.
+    """
+    for ids in chunks(post_ids):
+        by_author = defaultdict(list)
+        for post in Post.objects.filter(pk__in=ids).only(
+                'id', 'author_id', 'pub_date'):
+            by_author[post.author_id].append(post)
+        for author_id, posts in by_author.items():
+            followers = Follow.objects.filter(
+                following=author_id).values_list('user_id', flat=True)
+            batch = []
+            for user_id in followers.iterator(chunk_size=BATCH_SIZE):
+                batch.extend(TimelineEntry(
+                    user_id=user_id, post_id=post.id,
+                    author_id=author_id, pub_date=post.pub_date,
+                ) for post in posts)
+                if len(batch) >= BATCH_SIZE:
+                    _bulk_insert(batch)
+                    batch = []
+            _bulk_insert(batch)
+
+
+def backfill(user_id, author_id):
+    """
+    Добавляет в ленту пользователя все записи автора после подписки.
+    """
+    posts = Post.objects.filter(
+        author=author_id).values_list('id', 'pub_date')
+    batch = []
+    for post_id, pub_date in posts.iterator(chunk_size=BATCH_SIZE):
+        batch.append(TimelineEntry(
+            user_id=user_id, post_id=post_id,
+            author_id=author_id, pub_date=pub_date,
+        ))
+        if len(batch) >= BATCH_SIZE:
+            _bulk_insert(batch)
+            batch = []
+    _bulk_insert(batch)
+    bump_version(timeline_version(user_id))
+
+
+def remove(user_id, author_id):
+    """
+    Убирает записи автора из ленты пользователя после отписки.
+    """
+    TimelineEntry.objects.filter(user=user_id, author=author_id).delete()
+    bump_version(timeline_version(user_id))
+
+
+@transaction.atomic
+def rebuild():
+    """
+    Пересобирает ленты всех пользователей из подписок и записей.
+    """
+    TimelineEntry.objects.all().delete()
+    follows = Follow.objects.values_list('user_id', 'following_id')
+    for user_id, author_id in follows.iterator(chunk_size=BATCH_SIZE):
+        backfill(user_id, author_id)
+    bump_version(FEED)
@@ -0,0 +1,167 @@
+import math
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .cache import bump_version
+from .models import (ActivityBucket, Comment, Group, Post, Trending,
+                     Watermark)
+
+
+# Окно, в котором считается активность
+WINDOW = timezone.timedelta(hours=48)
+# Через столько часов вклад события в рейтинг уменьшается вдвое
+HALF_LIFE = 12
+# Вес самой публикации записи по сравнению с одним комментарием
+POST_WEIGHT = 2
+# Насколько подписчики автора поднимают запись
+FOLLOWER_WEIGHT = 0.5
+# Сколько позиций рейтинга хранить
+LIMIT = 100
+# Дольше этого транзакция со строкой не фиксируется. id выдаются до
+# фиксации, поэтому более свежие строки водяной знак не проходит: строка
+# с меньшим id может появиться позже строки с большим
+COMMIT_LAG = timezone.timedelta(minutes=5)
+
+# Имя версии кэша готового рейтинга
+TRENDING = 'trending'
+
+POST = ActivityBucket.POST
+GROUP = ActivityBucket.GROUP
+
+
+def _advance(name, queryset, fields, now):
+    """
+    Счетчики по часам для строк queryset новее водяного знака name.
+    Сам знак сдвигается на последний учтенный id, но не дальше первой
+    строки моложе COMMIT_LAG: такие строки учтет следующий запуск.
+    """
+    mark, _ = Watermark.objects.select_for_update().get_or_create(name=name)
+    cutoff = now - COMMIT_LAG
+    pending = queryset.filter(id__gt=mark.value)
+    last_id = pending.filter(
+        **{'%s__lt' % fields['date']: cutoff}
+    ).aggregate(m=Max('id'))['m'] or mark.value
+    first_young = pending.filter(
+        **{'%s__gte' % fields['date']: cutoff}
+    ).aggregate(m=Min('id'))['m']
+    if first_young is not None:
+        last_id = min(last_id, first_young - 1)
+    rows = queryset.filter(
+        id__gt=mark.value, id__lte=last_id,
+        **{'%s__gte' % fields['date']: now - WINDOW}
+    ).annotate(hour=TruncHour(fields['date'])).values(
+        'hour', *fields['keys']).annotate(count=Count('id')).order_by()
+    mark.value = last_id
+    mark.save(update_fields=['value'])
+    return rows
+
+
+def _add(totals, kind, object_id, hour, posts=0, comments=0):
+    if object_id is not None:
+        bucket = totals[(kind, object_id, hour)]
+        bucket['posts'] += posts
+        bucket['comments'] += comments
+
+
+def _save_buckets(totals):
+    """
+    Прибавляет новые счетчики к часовым строкам: существующие
+    обновляются, недостающие создаются пачкой.
+    """
+    for (kind, object_id, hour), values in totals.items():
+        updated = ActivityBucket.objects.filter(
+            kind=kind, object_id=object_id, hour=hour
+        ).update(posts=F('posts') + values['posts'],
+                 comments=F('comments') + values['comments'])
+        if updated:
+            values['saved'] = True
+    ActivityBucket.objects.bulk_create([
+        ActivityBucket(kind=kind, object_id=object_id, hour=hour,
+                       posts=values['posts'], comments=values['comments'])
+        for (kind, object_id, hour), values in totals.items()
+        if not values.get('saved')
+    ])
+
+
+def collect(now=None):
+    """
+    Учитывает новые записи и комментарии с прошлого запуска
+    и удаляет часы, выпавшие из окна.
+    """
+    now = now or timezone.now()
+    totals = defaultdict(Counter)
+    posts = _advance('trending_posts', Post.objects.all(), {
+        'date': 'pub_date', 'keys': ('id', 'group_id')}, now)
+    for row in posts:
+        _add(totals, POST, row['id'], row['hour'], posts=row['count'])
+        _add(totals, GROUP, row['group_id'], row['hour'], posts=row['count'])
+    comments = _advance('trending_comments', Comment.objects.all(), {
+        'date': 'created', 'keys': ('post_id', 'post__group_id')}, now)
+    for row in comments:
+        _add(totals, POST, row['post_id'], row['hour'],
+             comments=row['count'])
+        _add(totals, GROUP, row['post__group_id'], row['hour'],
+             comments=row['count'])
+    _save_buckets(totals)
+    ActivityBucket.objects.filter(hour__lt=now - WINDOW).delete()
+
+
+def _decay(hour, now):
+    age = (now - hour).total_seconds() / 3600
+    return 0.5 ** (max(age, 0) / HALF_LIFE)
+
+
+def scores(now=None):
+    """
+    Рейтинг записей и групп по часовым строкам окна. Подписчики
+    авторов берутся из готовых счетчиков UserStats.
+    """
+    now = now or timezone.now()
+    result = {POST: Counter(), GROUP: Counter()}
+    for bucket in ActivityBucket.objects.filter(hour__gte=now - WINDOW):
+        result[bucket.kind][bucket.object_id] += _decay(bucket.hour, now) * (
+            bucket.posts * POST_WEIGHT + bucket.comments)
+    followers = dict(Post.objects.filter(
+        id__in=list(result[POST])
+    ).values_list('id', 'author__stats__followers_count'))
+    for post_id in list(result[POST]):
+        if post_id not in followers:
+            # Запись удалена
+            del result[POST][post_id]
+            continue
+        result[POST][post_id] *= (
+            1 + FOLLOWER_WEIGHT * math.log1p(followers[post_id] or 0))
+    existing_groups = set(Group.objects.filter(
+        id__in=list(result[GROUP])).values_list('id', flat=True))
+    for group_id in list(result[GROUP]):
+        if group_id not in existing_groups:
+            del result[GROUP][group_id]
+    return result
+
+
+@transaction.atomic
+def update(now=None):
+    """
+    Периодическая задача: дописывает новую активность и пересобирает
+    небольшую таблицу рейтинга, которую читают страницы.
+    """
+    now = now or timezone.now()
+    collect(now)
+    ranked = scores(now)
+    Trending.objects.all().delete()
+    Trending.objects.bulk_create([
+        Trending(kind=kind, object_id=object_id, rank=rank, score=score)
+        for kind, counter in ranked.items()
+        for rank, (object_id, score) in enumerate(
+            counter.most_common(LIMIT), 1)
+    ])
+    bump_version(TRENDING)
+
+
+def top_ids(kind, limit=LIMIT):
+    return list(Trending.objects.filter(kind=kind).order_by(
+        'rank').values_list('object_id', flat=True)[:limit])
@@ -9,6 +9,16 @@ urlpatterns = [
     path('group/<slug:slug>', views.group, name='group'),
     # Страница со списком всех групп
     path('groups/', views.groups, name="groups"),
+    # Популярные записи и группы
+    path('trending/', views.trending, name='trending'),
+    path('groups/popular/', views.popular_groups, name='popular_groups'),
+    # Поиск по записям и группам
+    path('search/', views.search, name='search'),
+    # Выгрузка записей автора или группы
+    path('export/user/<username>/', views.export_profile,
+         name='export_profile'),
+    path('export/group/<slug:slug>/', views.export_group,
+         name='export_group'),
     # Страница создания нового поста
     path('new/', views.new_post, name="new_post"),
     # Страница создания новой группы
@@ -32,6 +42,9 @@ urlpatterns = [
     # Удаление записи
     path("<username>/<int:post_id>/delete/",
          views.post_delete, name="post_delete"),
+    # Подгрузка комментариев
+    path("<username>/<int:post_id>/comments/",
+         views.post_comments, name="post_comments"),
     # Добавление комментариев
     path("<username>/<int:post_id>/comment",
          views.add_comment, name="add_comment"),
@@ -1,4 +1,8 @@
-from django.template.defaultfilters import slugify
+import re
+import unicodedata
+from contextlib import contextmanager
+
+from django.db.models import Q
 
 
 alphabet = {
@@ -36,5 +40,102 @@ alphabet = {
 }
 
 
+# Таблица для str.translate: транслитерация за один проход по строке
+TRANSLIT = str.maketrans(alphabet)
+
+_NOT_SLUG = re.compile(r'[^\w\s-]')
+_DASHES = re.compile(r'[-\s]+')
+
+
 def my_slugify(s):
-    return slugify(''.join(alphabet.get(w, w) for w in s.lower()))
+    """
+    Транслитерация и slugify из Django за один проход без словаря
+    на каждый символ. Результат тот же, что у slugify(транслит).
+    """
+    value = s.lower().translate(TRANSLIT)
+    if not value.isascii():
+        value = unicodedata.normalize('NFKD', value).encode(
+            'ascii', 'ignore').decode('ascii').lower()
+    return _DASHES.sub('-', _NOT_SLUG.sub('', value).strip())
+
+
+def slug_base(text):
+    # Место под суффикс -NNNN в поле из 50 символов
+    return my_slugify(text)[:45].strip('-') or 'group'
+
+
+def pick_slug(base, used):
+    """
+    Первый свободный вариант base, base-2, base-3...
+    """
+    slug, number = base, 1
+    while slug in used:
+        number += 1
+        slug = '%s-%d' % (base, number)
+    return slug
+
+
+def unique_slug(text, exclude_pk=None):
+    """
+    Уникальный slug для одной группы. Занятые варианты выбираются одним
+    запросом по префиксу, который идет по индексу поля slug.
+    """
+    from .models import Group
+
+    base = slug_base(text)
+    used = set(Group.objects.filter(
+        slug__startswith=base, slug__regex=r'^%s(-[0-9]+)?$' % re.escape(base)
+    ).exclude(pk=exclude_pk).values_list('slug', flat=True))
+    return pick_slug(base, used)
+
+
+@contextmanager
+def manual_dates(*fields):
+    """
+    Временно отключает auto_now_add, чтобы сохранить даты из данных.
+    """
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def chunks(ids, size=5000):
+    """
+    Наборы id частями, чтобы условие IN не разрасталось. None значит
+    "все строки" и отдается как есть.
+    """
+    if ids is None:
+        yield None
+        return
+    ids = sorted(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def unique_slugs(titles, exclude=()):
+    """
+    Уникальные slug для пачки названий: занятые в базе варианты
+    выбираются запросом по префиксам на сотню основ. Группы exclude
+    (пересчитываемые сейчас) своими старыми slug места не занимают.
+    """
+    from .models import Group
+
+    bases = [slug_base(title) for title in titles]
+    unique_bases = sorted(set(bases))
+    used = set()
+    for start in range(0, len(unique_bases), 100):
+        query = Q()
+        for base in unique_bases[start:start + 100]:
+            query |= Q(slug__startswith=base)
+        used.update(Group.objects.filter(query).exclude(
+            pk__in=list(exclude)).values_list('slug', flat=True))
+    slugs = []
+    for base in bases:
+        slug = pick_slug(base, used)
+        used.add(slug)
+        slugs.append(slug)
+    return slugs
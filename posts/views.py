@@ -1,47 +1,117 @@
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
-from django.db.models import Count
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 
 from .forms import PostForm, GroupForm, CommentForm
-from .models import User, Post, Group, Comment, Follow
+from . import export, thumbnails, trending as ranking
+from .cache import (FEED, feed_tag, get_version, group_tag, posts_tags,
+                    tag_request, user_version)
+from .conditional import (conditional_page, feed_versions, follow_versions,
+                          profile_versions, trending_versions)
+from .counters import get_stats
+from .jobs import enqueue
+from .models import User, Post, Group, Comment, Follow, TimelineEntry
+from .pagination import get_cursor_page
+from .search import filter_groups, filter_posts
+from .serializers import comment_data
 
 
+# Сколько комментариев показывать сразу и подгружать за раз
+COMMENTS_PER_PAGE = 20
+
+
+def feed_posts():
+    """
+    Записи для лент вместе с автором и группой - один запрос на страницу.
+    """
+    return Post.objects.select_related('author', 'group')
+
+
+@conditional_page(feed_versions)
 def index(request):
-    post_list = Post.objects.select_related(
-        'author', 'group').order_by('-pub_date')
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, 'index.html', {'page': page, 'paginator': paginator})
+    post_list = feed_posts()
+    page = get_cursor_page(request, post_list, 10)
+    tag_request(request, feed_tag('index'), *posts_tags(page))
+    return render(
+        request, 'index.html',
+        {'page': page, 'feed_version': get_version(FEED)}
+    )
 
 
+@conditional_page(feed_versions)
 def group(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    post = Post.objects.filter(group=group).order_by("-pub_date")
-    paginator = Paginator(post, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    group = get_object_or_404(Group.objects.select_related('author'), slug=slug)
+    post = feed_posts().filter(group=group)
+    page = get_cursor_page(request, post, 10)
+    tag_request(request, feed_tag('group', group.id), group_tag(group.id),
+                *posts_tags(page))
     return render(
         request, "group.html",
         {
             "group": group,
             "page": page,
-            'paginator': paginator
         }
     )
 
 
+# Сортировки списка групп: ключ курсора и направление
+GROUP_ORDERINGS = {
+    'title': ('title', False),
+    'active': ('last_activity', True),
+}
+
+
 def groups(request):
-    group_list = Group.objects.order_by('title')
-    paginator = Paginator(group_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    sort = request.GET.get('sort')
+    if sort not in GROUP_ORDERINGS:
+        sort = 'title'
+    key, descending = GROUP_ORDERINGS[sort]
+    page = get_cursor_page(
+        request, Group.objects.all(), 10, key=key, descending=descending)
     return render(
         request, "groups.html",
         {
             "page": page,
-            'paginator': paginator
+            "sort": sort,
+        }
+    )
+
+
+def ranked(queryset, ids):
+    """
+    Объекты по списку id из готового рейтинга, в порядке рейтинга.
+    """
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
+
+
+@conditional_page(trending_versions)
+def trending(request):
+    posts = ranked(feed_posts(), ranking.top_ids(ranking.POST, 30))
+    return render(request, 'trending.html', {'posts': posts})
+
+
+@conditional_page(trending_versions)
+def popular_groups(request):
+    groups = ranked(Group.objects.all(), ranking.top_ids(ranking.GROUP, 30))
+    return render(request, 'popular_groups.html', {'groups': groups})
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page = None
+    groups = []
+    if query:
+        posts, key = filter_posts(feed_posts(), query)
+        page = get_cursor_page(request, posts, 10, key=key)
+        if not page.has_previous():
+            groups = filter_groups(Group.objects.all(), query)[:5]
+    return render(
+        request, 'posts/search.html',
+        {
+            'query': query,
+            'page': page,
+            'groups': groups
         }
     )
 
@@ -115,6 +185,9 @@ def new_post(request):
             post = form.save(commit=False)
             post.author = request.user
             post.save()
+            if (post.image and not post.thumbnails_ready
+                    and not thumbnails.reuse(post)):
+                enqueue('generate_thumbnails', post_id=post.id)
             return redirect('index')
     else:
         form = PostForm()
@@ -142,6 +215,9 @@ def post_edit(request, username, post_id):
                 post = form.save(commit=False)
                 post.author = request.user
                 post.save()
+                if (post.image and not post.thumbnails_ready
+                        and not thumbnails.reuse(post)):
+                    enqueue('generate_thumbnails', post_id=post.id)
                 return redirect('post', username=post.author, post_id=post.id)
         else:
             form = PostForm(instance=post)
@@ -153,59 +229,79 @@ def post_edit(request, username, post_id):
     return redirect('post', username=post.author, post_id=post.id)
 
 
+@conditional_page(profile_versions)
 def profile(request, username):
     profile = get_object_or_404(User, username=username)
-    posts = Post.objects.select_related(
-        'author', 'group').order_by('-pub_date').filter(author=profile.id)
+    posts = feed_posts().filter(author=profile.id)
     following = False
     if request.user.is_authenticated:
-        follow_count = Follow.objects.filter(
+        following = Follow.objects.filter(
             user=request.user, following=profile
-        ).count()
-        if follow_count > 0:
-            following = True
-    followers = Follow.objects.filter(following=profile).count()
-    follow = Follow.objects.filter(user=profile).count()
-    paginator = Paginator(posts, 5)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+        ).exists()
+    stats = get_stats(profile)
+    page = get_cursor_page(request, posts, 5)
+    tag_request(request, feed_tag('author', profile.id),
+                user_version(profile.id), *posts_tags(page))
     return render(
         request, "posts/profile.html",
         {
             'profile': profile,
-            'posts': posts,
-            'paginator': paginator,
             'page': page,
             'following': following,
-            'followers': followers,
-            'follow': follow
+            'followers': stats.followers_count,
+            'follow': stats.following_count,
+            'posts_count': stats.posts_count,
         }
     )
 
 
+@conditional_page(profile_versions)
 def post_view(request, username, post_id):
     profile = get_object_or_404(User, username=username)
     form = CommentForm()
-    post = Post.objects.select_related(
-        'author', 'group'
-    ).annotate(
-        comment_count=Count('post_comments')
-    ).get(id=post_id)
-    followers = Follow.objects.filter(following=profile).count()
-    follow = Follow.objects.filter(user=profile).count()
-    comments = Comment.objects.filter(post=post_id)
-    # мб костыль
-    posts = Post.objects.select_related(
-        'author', 'group').order_by('-pub_date').filter(author=profile.id)
+    post = feed_posts().get(id=post_id)
+    stats = get_stats(profile)
+    comments = get_comments_page(request, post_id)
+    tag_request(request, *posts_tags([post]), user_version(profile.id))
     return render(
         request, 'posts/post_detail.html',
         {
             'profile': profile,
             'post': post,
-            'posts': posts,
             'comments': comments,
             'form': form,
-            'followers': followers, 'follow': follow
+            'followers': stats.followers_count,
+            'follow': stats.following_count,
+            'posts_count': stats.posts_count,
+        }
+    )
+
+
+def get_comments_page(request, post_id):
+    comments = Comment.objects.select_related('author').filter(post=post_id)
+    return get_cursor_page(
+        request, comments, COMMENTS_PER_PAGE, key='created', descending=False)
+
+
+def post_comments(request, username, post_id):
+    """
+    Следующая порция комментариев: HTML-фрагмент или JSON с ?format=json.
+    """
+    if not Post.objects.filter(
+            id=post_id, author__username=username).exists():
+        raise Http404
+    comments = get_comments_page(request, post_id)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'comments': [comment_data(comment) for comment in comments],
+            'next_cursor': comments.next_cursor,
+        })
+    return render(
+        request, 'posts/comment_list.html',
+        {
+            'comments': comments,
+            'username': username,
+            'post_id': post_id,
         }
     )
 
@@ -243,21 +339,20 @@ def add_comment(request, username, post_id):
     return redirect('post', username=post.author.username, post_id=post_id)
 
 
+def get_follow_page(request):
+    entries = TimelineEntry.objects.select_related(
+        'post__author', 'post__group'
+    ).filter(user=request.user)
+    page = get_cursor_page(request, entries, 10)
+    page.object_list = [entry.post for entry in page]
+    return page
+
+
 @login_required
+@conditional_page(follow_versions)
 def follow_index(request):
-    favorites = Follow.objects.filter(user=request.user)
-    favorite_authors = [favorite.following.id for favorite in favorites]
-    post_list = Post.objects.select_related(
-        'author', 'group'
-    ).filter(
-        author__in=favorite_authors
-    ).order_by('-pub_date')
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(
-        request, "posts/follow.html", {'page': page, 'paginator': paginator}
-    )
+    page = get_follow_page(request)
+    return render(request, "posts/follow.html", {'page': page})
 
 
 @login_required
@@ -284,3 +379,40 @@ def profile_unfollow(request, username):
             Follow.objects.filter(user=user, following=author).delete()
             return redirect('profile', username=author)
     return redirect('index')
+
+
+def export_response(request, posts, name):
+    """
+    Выгрузка записей потоком: ?format=ndjson|csv, ?gzip=1 для сжатия.
+    """
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in export.FORMATS:
+        fmt = 'ndjson'
+    compress = request.GET.get('gzip') == '1'
+    response = StreamingHttpResponse(
+        export.stream(posts, fmt, compress,
+                      comments=request.GET.get('comments') != '0'),
+        content_type=('application/gzip' if compress
+                      else export.FORMATS[fmt][0]),
+    )
+    response['Content-Disposition'] = 'attachment; filename="%s"' % (
+        export.filename(name, fmt, compress))
+    return response
+
+
+@login_required
+def export_profile(request, username):
+    author = get_object_or_404(User, username=username)
+    if request.user != author and not request.user.is_staff:
+        return redirect('profile', username=username)
+    return export_response(
+        request, Post.objects.filter(author=author), author.username)
+
+
+@login_required
+def export_group(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    if request.user.id != group.author_id and not request.user.is_staff:
+        return redirect('group', slug=slug)
+    return export_response(
+        request, Post.objects.filter(group=group), group.slug)
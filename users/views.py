@@ -1,6 +1,7 @@
-from django.core.mail import send_mail
 from django.views.generic import CreateView
 
+from posts.jobs import enqueue
+
 from .forms import CreationForm
 
 
@@ -11,11 +12,12 @@ class SignUp(CreateView):
 
     def form_valid(self, form):
         email = form.cleaned_data['email']
-        send_mail(
-            'Регистрация',
-            'Вы успешно прошли регистрацию на сайте Yatube.',
-            'team.yatube@yandex.ru',
-            [email],
-            fail_silently=True,
+        # Письмо отправит фоновый обработчик, чтобы не держать запрос
+        enqueue(
+            'send_mail',
+            subject='Регистрация',
+            message='Вы успешно прошли регистрацию на сайте Yatube.',
+            from_email='team.yatube@yandex.ru',
+            recipient_list=[email],
         )
         return super().form_valid(form)
@@ -50,15 +50,54 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'posts.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'posts.routers.PrimaryPinMiddleware',
+    'posts.middleware.AnonymousPageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'posts.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Сколько SQL-запросов может выполнить страница (по имени URL).
+# При превышении пишем предупреждение или, если QUERY_BUDGET_ACTION=raise,
+# падаем с ошибкой
+QUERY_BUDGETS = {
+    'index': 3,
+    'group': 4,
+    'groups': 4,
+    'profile': 7,
+    'post': 7,
+    'follow_index': 3,
+    'post_comments': 4,
+    'trending': 4,
+    'popular_groups': 4,
+    'api_posts': 3,
+    'api_group_posts': 4,
+    'api_profile_posts': 5,
+    'api_follow': 3,
+    'api_post': 3,
+    'api_post_comments': 4,
+}
+QUERY_BUDGET_ACTION = os.getenv('QUERY_BUDGET_ACTION', 'warn')
+
+# Сколько секунд анонимные страницы лент могут храниться в кэше nginx
+# и браузера без повторной проверки
+PAGE_CACHE_MAX_AGE = int(os.getenv('PAGE_CACHE_MAX_AGE', 10))
+
+# Страницы, которые целиком кэшируются для анонимных посетителей
+PAGE_CACHE_URL_NAMES = ('index', 'group', 'profile', 'post')
+PAGE_CACHE_TIMEOUT = 600
+# Раз во сколько секунд воркер записывает счетчики попаданий в общий кэш
+PAGE_CACHE_STATS_FLUSH = 10
+
+# Сколько последних отчетов профилировщика хранить
+PROFILER_MAX_REPORTS = 200
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
@@ -71,12 +110,22 @@ INTERNAL_IPS = [
 
 ROOT_URLCONF = 'yatube.urls'
 
+# Файловый кэш общий для всех воркеров gunicorn, ключи лент версионируются
+# сигналами, поэтому срок жизни можно держать большим
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
+# Тесты работают с кэшем в памяти, а не с каталогом cache/ проекта
+TEST_RUNNER = 'yatube.test_runner.LocalCacheTestRunner'
+
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
@@ -108,9 +157,33 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        # Соединение живет между запросами воркера не дольше
+        # DB_CONN_MAX_AGE секунд (0 - закрывать после каждого запроса)
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        # При первом обращении к базе в запросе проверять соединение
+        # и открывать новое, если база его оборвала
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        # Закрывать соединение, простоявшее без дела дольше стольких секунд
+        'CONN_IDLE_TIMEOUT': int(os.getenv('DB_CONN_IDLE_TIMEOUT', 30)),
     }
 }
 
+# Реплики для чтения: DB_REPLICA_HOSTS=host1,host2. Остальные параметры
+# берутся из основной базы, в тестах реплики смотрят в тестовую основную
+REPLICA_DATABASES = []
+for number, host in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    alias = 'replica%d' % number
+    DATABASES[alias] = dict(
+        DATABASES['default'], HOST=host.strip(), TEST={'MIRROR': 'default'})
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['posts.routers.ReplicaRouter']
+
+# Сколько секунд после записи пользователь читает с основной базы.
+# Это же верхняя граница отставания реплик для кэша страниц
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
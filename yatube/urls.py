@@ -21,6 +21,8 @@ urlpatterns = [
          {'url': '/about-author/'}, name='about_author'),
     path('about-spec/', views.flatpage,
          {'url': '/about-spec/'}, name='about_spec'),
+    # JSON API только для чтения
+    path('api/v1/', include('posts.api_urls')),
     # import из приложения posts
     path('', include('posts.urls')),
 ]